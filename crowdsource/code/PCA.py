@@ -8,44 +8,88 @@
 
 from __future__ import division, print_function, absolute_import
 
+from itertools import product
+
 import numpy as np
-from sklearn.decomposition import PCA
+from scipy import linalg
 
 from utils import scale
 
 
+# Memory layout of the filtering pipeline: the filters and the weighting
+# functions work frame by frame, so signals are kept in row-major (C) order
+# with frames contiguous in memory, and they are processed by chunks of
+# CHUNK_ROWS frames so that temporaries are bounded by a chunk instead of
+# the whole recording. The covariance step (PCA) accepts any layout.
+CHUNK_ROWS = 4096
+
+
+def _chunks(n_samples):
+    """Private function iterating over (start, stop) chunks of frames."""
+    for start in range(0, n_samples, CHUNK_ROWS):
+        yield start, min(start + CHUNK_ROWS, n_samples)
+
+
+def _roll_sum(X, terms):
+    """Private function computing the sum of coef * np.roll(X, shift, axis=0)
+    over the (shift, coef) of terms, in this order, into a C-contiguous
+    array."""
+    n_samples = X.shape[0]
+    X_new = np.empty(X.shape, dtype=X.dtype)
+
+    for start, stop in _chunks(n_samples):
+        block = X_new[start:stop]
+        for index, (shift, coef) in enumerate(terms):
+            if 0 <= start - shift and stop - shift <= n_samples:
+                term = X[start - shift:stop - shift]
+            else:
+                term = X.take(np.arange(start - shift, stop - shift), axis=0,
+                              mode="wrap")
+            if coef != 1:
+                term = coef * term
+
+            if index == 0:
+                block[...] = term
+            else:
+                block += term
+
+    return X_new
+
+
 ###########################################
 ######### SIMPLIFIED METHOD ###############
 ###########################################
 
 def f1(X):
-    return X + np.roll(X, -1, axis=0) + np.roll(X, 1, axis=0)
+    return _roll_sum(X, [(0, 1), (-1, 1), (1, 1)])
 
 def f2(X):
-    return X + np.roll(X, 1, axis=0) + 0.8 * np.roll(X, 2, axis=0) + 0.4 * np.roll(X, 3, axis=0)
+    return _roll_sum(X, [(0, 1), (1, 1), (2, 0.8), (3, 0.4)])
 
 def g(X):
     return np.diff(X, axis=0)
 
-def h(X, threshold = 0.11):
-    threshold1 = X < threshold * 1
-    threshold2 = X >= threshold * 1
-    X_new = np.zeros_like(X)
-    X_new[threshold1] = 0
-    X_new[threshold2] = X[threshold2]
-    return X_new
+def h(X, threshold = 0.11, copy=True):
+    if copy:
+        X = np.array(X, order="C")
+    for start, stop in _chunks(X.shape[0]):
+        block = X[start:stop]
+        block[~(block >= threshold * 1)] = 0
+    return X
 
 def w(X):
     X_new = X
-    Sum_X_new = np.sum(X_new, axis=1)
-    Sum4 = Sum_X_new
-    normalization = np.max(Sum4)
-    for i in range(X_new.shape[0]):
-        r = Sum4[i] / normalization
-        if Sum4[i] != 0:
-            X_new[i, :] = ((X_new[i, :] + 1) ** (1 + (1. / Sum4[i])))
-        else:
-            X_new[i, :] = 1
+    Sum4 = np.sum(X_new, axis=1)
+    zero = Sum4 == 0
+    with np.errstate(divide="ignore"):
+        growth = 1 + (1. / Sum4)
+    growth[zero] = 1
+
+    for start, stop in _chunks(X_new.shape[0]):
+        block = X_new[start:stop]
+        block += 1
+        np.power(block, growth[start:stop, np.newaxis], out=block)
+        block[zero[start:stop]] = 1
     return X_new
 
 def simple_filter(X, LP='f1', threshold=0.11, weights=True):
@@ -56,12 +100,12 @@ def simple_filter(X, LP='f1', threshold=0.11, weights=True):
     else:
         raise ValueError("Unknown filter, got %s." % LP)
     X = g(X)
-    X = h(X)
+    X = h(X, copy=False)
     if weights:
         X = w(X)
     return X
 
-def tuned_filter(X, LP='f1', threshold=0.11, weights=True):
+def tuned_filter(X, LP='f1', threshold=0.11, weights=True, bands=None):
     if LP == 'f1':
         X = f1(X)
     elif LP == 'f2':
@@ -73,15 +117,155 @@ def tuned_filter(X, LP='f1', threshold=0.11, weights=True):
     else:
         raise ValueError("Unknown filter, got %s." % LP)
     X = g(X)
-    X = h(X)
-    X = r(X)
+    X = h(X, copy=False)
+    X = r(X, copy=False)
 
     if weights:
-        X = w_star(X)
+        X = w_star(X, bands=bands)
     return X
 
 
-def make_simple_inference(X):
+def pca_precision(covariance, n_components, whiten=True):
+    """Precision of a PCA model given the covariance of its training data
+
+    The returned matrix is the one of
+    PCA(whiten=whiten, n_components=n_components).fit(X).get_precision()
+    where covariance is the unbiased covariance of X. It allows to fit the
+    model from sufficient statistics instead of the signals themselves.
+
+    Parameters
+    ----------
+    covariance : numpy array of shape (n_nodes, n_nodes)
+        Unbiased covariance matrix of the filtered signals.
+
+    n_components : integer
+        Number of kept principal components.
+
+    whiten : boolean, optional (default=True)
+        Whether or not the PCA model whitens its components.
+
+    Returns
+    -------
+    precision : numpy array of shape (n_nodes, n_nodes)
+        Precision matrix of the PCA generative model.
+
+    """
+    n_nodes = covariance.shape[0]
+    eigvals, eigvecs = linalg.eigh(covariance)
+    eigvals = np.maximum(eigvals[::-1], 0.)
+    eigvecs = eigvecs[:, ::-1]
+
+    exp_var = eigvals[:n_components]
+    components = eigvecs[:, :n_components].T
+    if n_components < n_nodes:
+        noise_variance = eigvals[n_components:].mean()
+    else:
+        noise_variance = 0.
+
+    if whiten:
+        components = components * np.sqrt(exp_var[:, np.newaxis])
+    exp_var_diff = np.maximum(exp_var - noise_variance, 0.)
+
+    if noise_variance == 0.:
+        return linalg.inv(np.dot(components.T * exp_var_diff, components))
+
+    precision = np.dot(components, components.T) / noise_variance
+    precision.flat[::len(precision) + 1] += 1. / exp_var_diff
+    precision = np.dot(components.T,
+                       np.dot(linalg.inv(precision), components))
+    precision /= -(noise_variance ** 2)
+    precision.flat[::len(precision) + 1] += 1. / noise_variance
+    return precision
+
+
+def _top_edges(y, n_top):
+    """Private function returning the flat indices of the n_top strongest
+    off-diagonal scores of y."""
+    y = y.copy()
+    np.fill_diagonal(y, -np.inf)
+    return np.argpartition(y.ravel(), -n_top)[-n_top:]
+
+
+def rank_stability(y_prev, y_curr, n_top):
+    """Fraction of the n_top strongest edges shared by two score matrices
+
+    Parameters
+    ----------
+    y_prev : numpy array of shape (n_nodes, n_nodes)
+        Previous connectivity score.
+
+    y_curr : numpy array of shape (n_nodes, n_nodes)
+        Current connectivity score.
+
+    n_top : integer
+        Number of strongest edges to compare.
+
+    Returns
+    -------
+    overlap : float
+        Top-n_top overlap between y_prev and y_curr, between 0 and 1.
+
+    """
+    common = np.intersect1d(_top_edges(y_prev, n_top),
+                            _top_edges(y_curr, n_top))
+    return common.size / n_top
+
+
+def _is_stable(y_pred_agg, weight, y_prev, n_members, tol, check_every,
+               n_top):
+    """Private function used to check the rank stability of an ensemble
+
+    Returns the current normalised aggregate (or y_prev if no check was
+    performed) and whether the aggregation may stop.
+    """
+    if tol is None or n_members % check_every != 0:
+        return y_prev, False
+
+    y_curr = y_pred_agg / weight
+    if y_prev is None:
+        return y_curr, False
+
+    overlap = rank_stability(y_prev, y_curr, n_top)
+    print('Rank stability after %s members: %0.4f' % (n_members, overlap))
+    return y_curr, overlap >= 1. - tol
+
+
+def make_simple_inference(X, tol=None, check_every=20, n_top=None,
+                          return_n_members=False):
+    """Score neuron connectivity with the simplified method
+
+    Parameters
+    ----------
+    X : numpy array of shape (n_samples, n_nodes)
+        Fluorescence signals
+
+    tol : float or None, optional (default=None)
+        If not None, stop the aggregation of the ensemble as soon as the
+        top-n_top overlap between two successive checks of the running
+        average is at least 1 - tol. If None, all members are aggregated.
+
+    check_every : integer, optional (default=20)
+        Number of members between two rank stability checks.
+
+    n_top : integer or None, optional (default=None)
+        Number of strongest edges used to check rank stability. If None,
+        n_top is set to n_nodes.
+
+    return_n_members : boolean, optional (default=False)
+        Whether or not to return the number of aggregated members.
+
+    Returns
+    -------
+    score : numpy array of shape (n_nodes, n_nodes)
+        Pairwise neuron connectivity score.
+
+    n_members : integer
+        The number of aggregated members, returned only if
+        return_n_members is True.
+
+    """
+
+    from sklearn.decomposition import PCA
 
     print('Making simple inference...')
 
@@ -99,119 +283,119 @@ def make_simple_inference(X):
          0.201, 0.202, 0.203, 0.204, 0.205, 0.206, 0.207, 0.208, 0.209, 0.210]
 
     weight = 0
+    n_members = 0
+    y_prev = None
 
     n_samples, n_nodes = X.shape
     y_pred_agg = np.zeros((n_nodes, n_nodes))
+    if n_top is None:
+        n_top = n_nodes
 
+    for threshold, filtering in product(t, ["f1", "f2"]):
 
-    for threshold in t:
-        for filtering in ["f1", "f2"]:
+        print('Current: %0.3f, %s' % (threshold, filtering))
 
-            print('Current: %0.3f, %s' % (threshold, filtering))
+        X_new = simple_filter(X, LP = filtering, threshold = t, weights = True)
+        pca = PCA(whiten=True, n_components=int(0.8 * n_nodes)).fit(X_new)
+        y_pred = - pca.get_precision()
 
-            X_new = simple_filter(X, LP = filtering, threshold = t, weights = True)
-            pca = PCA(whiten=True, n_components=int(0.8 * n_nodes)).fit(X_new)
-            y_pred = - pca.get_precision()
+        if filtering == 'f1':
+            y_pred_agg += y_pred
+            weight += 1
+        elif filtering == 'f2':
+            y_pred_agg += y_pred * 0.9
+            weight += 0.9
 
-            if filtering == 'f1':
-                y_pred_agg += y_pred
-                weight += 1
-            elif filtering == 'f2':
-                y_pred_agg += y_pred * 0.9
-                weight += 0.9
+        n_members += 1
+        y_prev, stop = _is_stable(y_pred_agg, weight, y_prev, n_members,
+                                  tol, check_every, n_top)
+        if stop:
+            break
 
-    return scale(y_pred_agg / weight)
+    print('Aggregated %s members' % n_members)
+    if return_n_members:
+        return scale(y_pred_agg / weight, copy=False), n_members
+    return scale(y_pred_agg / weight, copy=False)
 
 ###########################################
 ############# TUNED METHOD ################
 ###########################################
 
 def f3(X):
-    return X + np.roll(X, -1, axis=0) + np.roll(X, -2, axis=0) + np.roll(X, 1, axis=0)
+    return _roll_sum(X, [(0, 1), (-1, 1), (-2, 1), (1, 1)])
 
 def f4(X):
-    return X + np.roll(X, -1, axis=0) + np.roll(X, -2, axis=0) + np.roll(X, -3, axis=0)
-
-def r(X):
-    return X**0.9
-
-def w_star(X, filtering = "f1"):
-
-    X_new = X
-
-    Sum_X_new = np.sum(X_new, axis=1)
-
-    Sum4 = Sum_X_new + 0.5 * np.roll(Sum_X_new, 1)
-
-    normalization = np.max(Sum4)
-
-    for i in range(X_new.shape[0]):
-
-        r = Sum4[i] / normalization
-
-        if filtering == "f1":
+    return _roll_sum(X, [(0, 1), (-1, 1), (-2, 1), (-3, 1)])
 
-            if Sum4[i] > 0 and r < 0.23 and r > 0.05:
-                X_new[i, :] = ((X_new[i, :] + 1) ** (1 + (1. / Sum4[i]))) ** 1.9
+def r(X, copy=True):
+    if copy:
+        return X**0.9
+    return np.power(X, 0.9, out=X)
 
-            elif Sum4[i] > 0 and r < 0.75:
-                X_new[i, :] = ((X_new[i, :] + 1) ** (1 + (1. / Sum4[i]))) ** 1.6
+# Weighting bands of w_star for each filtering: a list of
+# (r_min, r_max, exponent) checked in order, where r_min < r < r_max, and the
+# exponent used when no band matches.
+W_STAR_BANDS = {
+    "f1": ([(0.05, 0.23, 1.9), (0., 0.75, 1.6)], 1.4),
+    "f2": ([(0.05, 0.23, 1.9), (0., 0.75, 1.6)], 1.4),
+    "f3": ([(0.04, 0.22, 1.9), (0., 0.75, 1.7)], 1.5),
+    "f4": ([(0.08, 0.22, 1.9)], 1.5),
+}
 
-            elif Sum4[i] != 0:
-                X_new[i, :] = ((X_new[i, :] + 1) ** (1 + (1. / Sum4[i]))) ** 1.4
+DEFAULT_W_STAR_BANDS = ([], 1.6)
 
-            else:
-                X_new[i, :] = 1
-
-        elif filtering == "f2":
-
-            if Sum4[i] > 0 and r < 0.23 and r > 0.05:
-                X_new[i, :] = ((X_new[i, :] + 1) ** (1 + (1. / Sum4[i]))) ** 1.9
 
-            elif Sum4[i] > 0 and r < 0.75:
-                X_new[i, :] = ((X_new[i, :] + 1) ** (1 + (1. / Sum4[i]))) ** 1.6
+def w_star(X, filtering = "f1", bands=None, normalization=None,
+           previous_sum=None):
+    # normalization and previous_sum allow to weight X by chunks of frames:
+    # they are the maximum of Sum4 and the sum of the frame preceding X
+    # (by default, the last one of X) over the whole recording.
 
-            elif Sum4[i] != 0:
-
-                X_new[i, :] = ((X_new[i, :] + 1) ** (1 + (1. / Sum4[i]))) ** 1.4
-
-            else:
-                X_new[i, :] = 1
+    if bands is None:
+        bands = W_STAR_BANDS.get(filtering, DEFAULT_W_STAR_BANDS)
+    bands, default_exponent = bands
 
-        elif filtering == "f3":
-
-            if Sum4[i] > 0 and r < 0.22 and r > 0.04:
-                X_new[i, :] = ((X_new[i, :] + 1) ** (1 + (1. / Sum4[i]))) ** 1.9
-
-            elif Sum4[i] > 0 and r < 0.75:
-                X_new[i, :] = ((X_new[i, :] + 1) ** (1 + (1. / Sum4[i]))) ** 1.7
-
-            elif Sum4[i] != 0:
-                X_new[i, :] = ((X_new[i, :] + 1) ** (1 + (1. / Sum4[i]))) ** 1.5
-
-            else:
-                X_new[i, :] = 1
-
-        elif filtering == "f4":
+    X_new = X
 
-            if Sum4[i] > 0 and r < 0.22 and r > 0.08:
-                X_new[i, :] = ((X_new[i, :] + 1) ** (1 + (1. / Sum4[i]))) ** 1.9
+    Sum_X_new = np.sum(X_new, axis=1)
 
-            elif Sum4[i] != 0:
-                X_new[i, :] = ((X_new[i, :] + 1) ** (1 + (1. / Sum4[i]))) ** 1.5
+    Sum4 = Sum_X_new + 0.5 * np.roll(Sum_X_new, 1)
+    if previous_sum is not None:
+        Sum4[0] = Sum_X_new[0] + 0.5 * previous_sum
+
+    if normalization is None:
+        normalization = np.max(Sum4)
+
+    zero = Sum4 == 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = Sum4 / normalization
+        growth = 1 + (1. / Sum4)
+    growth[zero] = 1
+
+    # The first matching band gives the exponent of a frame
+    exponents = np.empty_like(growth)
+    exponents[:] = default_exponent
+    for r_min, r_max, exponent in reversed(bands):
+        exponents[(Sum4 > 0) & (r_min < r) & (r < r_max)] = exponent
+
+    for start, stop in _chunks(X_new.shape[0]):
+        block = X_new[start:stop]
+        block += 1
+        np.power(block, growth[start:stop, np.newaxis], out=block)
+        np.power(block, exponents[start:stop, np.newaxis], out=block)
+        block[zero[start:stop]] = 1
 
-            else:
-                X_new[i, :] = 1
+    return X_new
 
-        else:
-            if Sum4[i] != 0:
-                X_new[i, :] = ((X_new[i, :] + 1) ** (1 + (1. / Sum4[i]))) ** 1.6
-            else:
-                X_new[i, :] = 1
+def make_tuned_inference(X, tol=None, check_every=20, n_top=None,
+                         return_n_members=False):
+    """Score neuron connectivity with the tuned method
 
-    return X_new
+    See make_simple_inference for a description of the parameters and of
+    the returned values.
+    """
+    from sklearn.decomposition import PCA
 
-def make_tuned_inference(X):
     print('Making tuned inference...')
 
     t = [0.100, 0.101, 0.102, 0.103, 0.104, 0.105, 0.106, 0.107, 0.108, 0.109,
@@ -228,30 +412,41 @@ def make_tuned_inference(X):
          0.201, 0.202, 0.203, 0.204, 0.205, 0.206, 0.207, 0.208, 0.209, 0.210]
 
     weight = 0
+    n_members = 0
+    y_prev = None
 
     n_samples, n_nodes = X.shape
     y_pred_agg = np.zeros((n_nodes, n_nodes))
-
-
-    for threshold in t:
-        for filtering in ["f1", "f2", "f3", "f4"]:
-            print('Current: %0.3f, %s' % (threshold, filtering))
-
-            X_new = tuned_filter(X, LP = filtering, threshold = t, weights = True)
-            pca = PCA(whiten=True, n_components=int(0.8 * n_nodes)).fit(X_new)
-            y_pred = - pca.get_precision()
-
-            if filtering == 'f1':
-                y_pred_agg += y_pred
-                weight += 1
-            elif filtering == 'f2':
-                y_pred_agg += y_pred * 0.9
-                weight += 0.9
-            elif filtering == 'f3':
-                y_pred_agg += y_pred * 0.01
-                weight += 0.01
-            elif filtering == 'f4':
-                y_pred_agg += y_pred * 0.7
-                weight += 0.7
-
-    return scale(y_pred_agg / weight)
+    if n_top is None:
+        n_top = n_nodes
+
+    for threshold, filtering in product(t, ["f1", "f2", "f3", "f4"]):
+        print('Current: %0.3f, %s' % (threshold, filtering))
+
+        X_new = tuned_filter(X, LP = filtering, threshold = t, weights = True)
+        pca = PCA(whiten=True, n_components=int(0.8 * n_nodes)).fit(X_new)
+        y_pred = - pca.get_precision()
+
+        if filtering == 'f1':
+            y_pred_agg += y_pred
+            weight += 1
+        elif filtering == 'f2':
+            y_pred_agg += y_pred * 0.9
+            weight += 0.9
+        elif filtering == 'f3':
+            y_pred_agg += y_pred * 0.01
+            weight += 0.01
+        elif filtering == 'f4':
+            y_pred_agg += y_pred * 0.7
+            weight += 0.7
+
+        n_members += 1
+        y_prev, stop = _is_stable(y_pred_agg, weight, y_prev, n_members,
+                                  tol, check_every, n_top)
+        if stop:
+            break
+
+    print('Aggregated %s members' % n_members)
+    if return_n_members:
+        return scale(y_pred_agg / weight, copy=False), n_members
+    return scale(y_pred_agg / weight, copy=False)
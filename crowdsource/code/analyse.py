@@ -2,45 +2,41 @@ from copy import deepcopy
 from pprint import pprint
 import os
 
-from clusterlib.storage import sqlite3_loads
 from scipy.sparse import coo_matrix
-from sklearn.metrics import average_precision_score
-from sklearn.metrics import roc_auc_score
 import numpy as np
-import pandas as pd
 
+from datasets import load_manifest
 from launcher import OUTPUT_DIR
-from launcher import PARAMETER_GRID
+from launcher import get_parameter_grid
 from launcher import WORKING_DIR
 from main import get_sqlite3_path
 from main import make_hash
+from utils import load_network
+from utils import load_top_k
 from utils import scale
 
 
 def _roc_auc_score(y_true, y_score):
+    from sklearn.metrics import roc_auc_score
     try:
         return roc_auc_score(y_true, y_score)
     except ValueError:
         return np.nan
 
 
+def _average_precision_score(y_true, y_score):
+    from sklearn.metrics import average_precision_score
+    return average_precision_score(y_true, y_score)
+
+
 METRICS = {"roc_auc_score": _roc_auc_score,
-           "average_precision_score": average_precision_score}
+           "average_precision_score": _average_precision_score}
 
 
-def compute_scores(f_ground_truth, f_prediction, parameters):
+def load_ground_truth(f_ground_truth, parameters):
 
     # Load ground truth
-    raw_graph = np.loadtxt(f_ground_truth, delimiter=",")
-    row = raw_graph[:, 0] - 1
-    col = raw_graph[:, 1] - 1
-    data = raw_graph[:, 2]
-    valid_index = data > 0
-    y_true = coo_matrix((data[valid_index],
-                         (row[valid_index], col[valid_index])),
-                        shape=(1000, 1000))
-
-    y_true = y_true.toarray()
+    y_true = load_network(f_ground_truth)
 
     if parameters.get("killing", None):
 
@@ -56,6 +52,91 @@ def compute_scores(f_ground_truth, f_prediction, parameters):
         alive[kill - 1] = False  # we need the -1 since it's matlab indexing
         y_true = y_true[alive][:, alive]
 
+    return y_true
+
+
+def find_ground_truth(parameters, ground_truths):
+    """Path to the ground truth network of a job, or None if unknown
+
+    Recordings of the binary store get the network of their manifest entry
+    (ground_truths maps fluorescence paths to network paths), the others
+    the network file of their dataset directory.
+    """
+    if parameters["fluorescence"] in ground_truths:
+        return ground_truths[parameters["fluorescence"]]
+
+    network = parameters["network"]
+    if "normal-" in parameters["network"]:
+        network = parameters["network"][:len("normal-") + 1]
+    elif ("test" in parameters["network"] or
+            "valid" in parameters['network']):
+        return None
+
+    for bursting_type in ["normal-bursting", "low-bursting",
+                          "high-bursting"]:
+        if bursting_type in parameters["fluorescence"]:
+            return os.path.join(WORKING_DIR, "datasets", bursting_type,
+                                "network_%s.txt" % network)
+
+    return os.path.join(WORKING_DIR, "datasets", "network_%s.txt" % network)
+
+
+def precision_at_k(y_true, row, col, k=None):
+    """Fraction of true edges among the k first ranked edges"""
+    if k is None:
+        k = len(row)
+    return (y_true[row[:k], col[:k]] > 0).mean()
+
+
+def partial_roc_auc_score(y_true, row, col, max_fpr=0.1):
+    """Area under the ROC curve up to max_fpr, divided by max_fpr
+
+    Edges are given in decreasing order of score, all other pairs of
+    neurons are considered as tied with the lowest score. With max_fpr=1,
+    this is the usual area under the ROC curve.
+    """
+    n_positives = (y_true > 0).sum()
+    n_negatives = y_true.size - n_positives
+    hits = y_true[row, col] > 0
+
+    fpr = np.r_[0., np.cumsum(~hits) / n_negatives, 1.]
+    tpr = np.r_[0., np.cumsum(hits) / n_positives, 1.]
+
+    max_fpr = min(max_fpr, 1.)
+    stop = np.searchsorted(fpr, max_fpr, side="right")
+    if stop < len(fpr):
+        # Interpolate the curve at max_fpr on the segment crossing it
+        alpha = (max_fpr - fpr[stop - 1]) / (fpr[stop] - fpr[stop - 1])
+        fpr = np.r_[fpr[:stop], max_fpr]
+        tpr = np.r_[tpr[:stop],
+                    tpr[stop - 1] + alpha * (tpr[stop] - tpr[stop - 1])]
+
+    area = ((fpr[1:] - fpr[:-1]) * (tpr[1:] + tpr[:-1]) / 2.).sum()
+    return area / max_fpr
+
+
+def compute_sparse_scores(f_ground_truth, f_prediction, parameters,
+                          max_fpr=0.1):
+    """Compute measures from the top k edges saved with main.py --top_k
+
+    All pairs of neurons out of the top k are tied, so roc_auc_score_top_k
+    only approximates the roc_auc_score of the dense predictions.
+    """
+    y_true = load_ground_truth(f_ground_truth, parameters)
+    top_k = load_top_k(f_prediction)
+    row, col = top_k["row"], top_k["col"]
+
+    return {"precision_at_k": precision_at_k(y_true, row, col),
+            "partial_roc_auc_score": partial_roc_auc_score(y_true, row, col,
+                                                           max_fpr),
+            "roc_auc_score_top_k": partial_roc_auc_score(y_true, row, col,
+                                                         1.)}
+
+
+def compute_scores(f_ground_truth, f_prediction, parameters):
+
+    y_true = load_ground_truth(f_ground_truth, parameters)
+
     # Load predictions
     rows = []
     cols = []
@@ -82,37 +163,32 @@ def compute_scores(f_ground_truth, f_prediction, parameters):
 
 
 if __name__ == "__main__":
+    from clusterlib.storage import sqlite3_loads
+    import pandas as pd
 
     all_jobs_done = sqlite3_loads(get_sqlite3_path())
+    ground_truths = dict((entry["fluorescence"], entry["ground_truth"])
+                         for entry in load_manifest())
     results = []
 
-    for parameters in PARAMETER_GRID:
+    for parameters in get_parameter_grid():
         job_hash = make_hash(parameters)
         if job_hash in all_jobs_done:
-            fname = os.path.join(OUTPUT_DIR, "%s.csv" % job_hash)
+            if "top_k" in parameters:
+                fname = os.path.join(OUTPUT_DIR, "%s.npz" % job_hash)
+            else:
+                fname = os.path.join(OUTPUT_DIR, "%s.csv" % job_hash)
 
-            network = parameters["network"]
-            if "normal-" in parameters["network"]:
-                network = parameters["network"][:len("normal-") + 1]
-            elif ("test" in parameters["network"] or
-                    "valid" in parameters['network']):
+            ground_truth = find_ground_truth(parameters, ground_truths)
+            if ground_truth is None:
                 # We don't have the ground truth network
                 continue
 
-            for bursting_type in ["normal-bursting", "low-bursting",
-                                  "high-bursting"]:
-                if bursting_type in parameters["fluorescence"]:
-                    ground_truth = os.path.join(WORKING_DIR, "datasets",
-                                                bursting_type,
-                                                "network_%s.txt" % network)
-                    break
+            if "top_k" in parameters:
+                measure = compute_sparse_scores(ground_truth, fname,
+                                                parameters)
             else:
-                ground_truth = os.path.join(WORKING_DIR, "datasets",
-                                            "network_%s.txt" % network)
-
-            ground_truth = os.path.join(WORKING_DIR, "datasets",
-                                        "network_%s.txt" % network)
-            measure = compute_scores(ground_truth, fname, parameters)
+                measure = compute_scores(ground_truth, fname, parameters)
             row = deepcopy(parameters)
             row.update(measure)
             pprint(row)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+# Authors: Aaron Qiu <zqiu@ulg.ac.be>,
+#          Antonio Sutera <a.sutera@ulg.ac.be>,
+#          Arnaud Joly <a.joly@ulg.ac.be>,
+#          Gilles Louppe <g.louppe@ulg.ac.be>,
+#          Vincent Francois <v.francois@ulg.ac.be>
+#
+# License: BSD 3 clause
+"""Batched inference over many small networks in one process
+
+The small (N100) bursting recordings are processed by batches of recordings
+of the same shape. They are stacked as an array of shape
+(n_samples, n_networks, n_nodes), so that the filters of PCA.py work along
+the time axis unchanged, and all the precision matrices of a batch are
+obtained with one batched covariance and one batched eigh.
+
+As with make_simple_inference and make_tuned_inference, an ensemble reduces
+to one member per low-pass filter (see sweep.py).
+
+Each network gets its own result file and job store entry, with the job
+hash of main.py, so that launcher.py sees those jobs as done.
+
+    python batch.py -b low-bursting -m simple -o ~/scikit_learn_data/connectomics/submission
+"""
+from __future__ import division, print_function, absolute_import
+
+import argparse
+import os
+from collections import defaultdict
+
+import numpy as np
+
+from PCA import g, h, r, w, w_star, pca_precision
+from main import get_sqlite3_path
+from main import make_hash
+from main import stack
+from main import write_submission
+from sweep import DEFAULT_GRID, LOW_PASS, METHOD_FILTERS
+from utils import scale
+
+MEMBER_WEIGHTS = DEFAULT_GRID["weights"][0]
+
+
+def batch_pca_precision(covariances, n_components, whiten=True):
+    """pca_precision over the leading axis of a stack of covariances
+
+    Parameters
+    ----------
+    covariances : numpy array of shape (n_networks, n_nodes, n_nodes)
+        Unbiased covariance matrices of the filtered signals.
+
+    n_components : integer
+        Number of kept principal components.
+
+    whiten : boolean, optional (default=True)
+        Whether or not the PCA model whitens its components.
+
+    Returns
+    -------
+    precisions : numpy array of shape (n_networks, n_nodes, n_nodes)
+        Precision matrices of the PCA generative models.
+
+    """
+    n_nodes = covariances.shape[-1]
+    diagonal = np.arange(n_nodes)
+
+    eigvals, eigvecs = np.linalg.eigh(covariances)
+    eigvals = np.maximum(eigvals[:, ::-1], 0.)
+    eigvecs = eigvecs[:, :, ::-1]
+
+    exp_var = eigvals[:, :n_components]
+    components = eigvecs[:, :, :n_components].transpose(0, 2, 1)
+    noise_variance = eigvals[:, n_components:].mean(axis=1)
+
+    if n_components >= n_nodes or np.any(noise_variance == 0.):
+        # Degenerate models are left to the unbatched version
+        return np.array([pca_precision(covariance, n_components, whiten)
+                         for covariance in covariances])
+
+    if whiten:
+        components = components * np.sqrt(exp_var[:, :, np.newaxis])
+    exp_var_diff = np.maximum(exp_var - noise_variance[:, np.newaxis], 0.)
+
+    components_t = components.transpose(0, 2, 1)
+    precisions = (np.matmul(components, components_t) /
+                  noise_variance[:, np.newaxis, np.newaxis])
+    precisions[:, diagonal[:n_components], diagonal[:n_components]] += \
+        1. / exp_var_diff
+    precisions = np.matmul(components_t,
+                           np.matmul(np.linalg.inv(precisions), components))
+    precisions /= -(noise_variance ** 2)[:, np.newaxis, np.newaxis]
+    precisions[:, diagonal, diagonal] += 1. / noise_variance[:, np.newaxis]
+    return precisions
+
+
+def _batch_filter(X, LP, method):
+    """Private function applying the filters of a method to stacked
+    recordings of shape (n_samples, n_networks, n_nodes)."""
+    n_nodes = X.shape[2]
+    X = h(g(LOW_PASS[LP](X)))
+
+    if method == "simple":
+        # w works frame by frame, whatever the network of the frame
+        X = w(X.reshape(-1, n_nodes)).reshape(X.shape)
+    else:
+        X = r(X)
+        # w_star normalises by the maximal activity of each recording
+        for i in range(X.shape[1]):
+            X[:, i, :] = w_star(X[:, i, :])
+
+    return X
+
+
+def batch_inference(X, method="simple"):
+    """Score neuron connectivity of stacked recordings
+
+    Parameters
+    ----------
+    X : numpy array of shape (n_samples, n_networks, n_nodes)
+        Fluorescence signals of recordings of the same shape.
+
+    method : "simple" or "tuned", optional (default="simple")
+        Inference method.
+
+    Returns
+    -------
+    scores : numpy array of shape (n_networks, n_nodes, n_nodes)
+        Pairwise neuron connectivity score of each network.
+
+    """
+    n_samples, n_networks, n_nodes = X.shape
+    n_components = int(0.8 * n_nodes)
+
+    weight = 0
+    y_pred_agg = np.zeros((n_networks, n_nodes, n_nodes))
+
+    for LP in METHOD_FILTERS[method]:
+        print('Current: %s, %s networks' % (LP, n_networks))
+        X_new = _batch_filter(X, LP, method)
+
+        # Batched covariance, networks on the leading axis
+        X_new = np.asarray(X_new.transpose(1, 0, 2), dtype=np.float64)
+        X_new -= X_new.mean(axis=1)[:, np.newaxis, :]
+        covariances = (np.matmul(X_new.transpose(0, 2, 1), X_new) /
+                       (X_new.shape[1] - 1))
+        del X_new
+
+        y_pred_agg -= (MEMBER_WEIGHTS[LP] *
+                       batch_pca_precision(covariances, n_components))
+        weight += MEMBER_WEIGHTS[LP]
+
+    y_pred_agg /= weight
+    for y_pred in y_pred_agg:
+        scale(y_pred, copy=False)
+    return y_pred_agg
+
+
+def group_by_shape(entries):
+    """Group manifest entries of recordings with the same shape"""
+    groups = defaultdict(list)
+    for entry in entries:
+        groups[entry["n_samples"], entry["n_nodes"]].append(entry)
+    return [groups[key] for key in sorted(groups)]
+
+
+def run_batch(entries, method, directivity, output_dir):
+    """Infer, save and mark as done the jobs of manifest entries
+
+    Returns the list of job hashes.
+    """
+    from clusterlib.storage import sqlite3_dumps
+
+    X = np.stack([np.load(entry["fluorescence"]) for entry in entries],
+                 axis=1)
+    scores = batch_inference(X, method=method)
+
+    if directivity:
+        from directivity import make_prediction_directivity
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    job_hashes = []
+    for i, entry in enumerate(entries):
+        args = {"network": entry["network"],
+                "fluorescence": entry["fluorescence"],
+                "method": method,
+                "directivity": directivity,
+                "output_dir": output_dir}
+        job_hash = make_hash(args)
+
+        score = scores[i]
+        if directivity:
+            score = stack(score, make_prediction_directivity(X[:, i, :]))
+
+        write_submission(score, entry["network"],
+                         os.path.join(output_dir, "%s.csv" % job_hash))
+        job_hashes.append(job_hash)
+
+    sqlite3_dumps(dict((job_hash, "JOB DONE") for job_hash in job_hashes),
+                  get_sqlite3_path())
+    return job_hashes
+
+
+if __name__ == "__main__":
+    from datasets import load_manifest, query_manifest
+    from launcher import OUTPUT_DIR
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--bursting', type=str, default=None,
+                        help='Only process this bursting type')
+    parser.add_argument('-m', '--method', type=str, default='simple',
+                        choices=["simple", "tuned"])
+    parser.add_argument('-d', '--directivity', type=int, default=0,
+                        choices=[0, 1])
+    parser.add_argument('-o', '--output_dir', type=str, default=OUTPUT_DIR)
+    parser.add_argument('--max_nodes', type=int, default=100,
+                        help='Only process networks up to this size')
+    parser.add_argument('--batch_size', type=int, default=8,
+                        help='Number of recordings stacked together')
+    args = vars(parser.parse_args())
+
+    criteria = {"n_nodes": lambda n_nodes: n_nodes <= args["max_nodes"]}
+    if args["bursting"] is not None:
+        criteria["bursting"] = args["bursting"]
+    entries = query_manifest(load_manifest(), **criteria)
+
+    n_done = 0
+    for group in group_by_shape(entries):
+        for start in range(0, len(group), args["batch_size"]):
+            job_hashes = run_batch(group[start:start + args["batch_size"]],
+                                   args["method"], args["directivity"],
+                                   args["output_dir"])
+            n_done += len(job_hashes)
+            print("%s / %s networks done" % (n_done, len(entries)))
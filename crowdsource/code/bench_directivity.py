@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# Authors: Aaron Qiu <zqiu@ulg.ac.be>,
+#          Antonio Sutera <a.sutera@ulg.ac.be>,
+#          Arnaud Joly <a.joly@ulg.ac.be>,
+#          Gilles Louppe <g.louppe@ulg.ac.be>,
+#          Vincent Francois <v.francois@ulg.ac.be>
+#
+# License: BSD 3 clause
+"""Speed and accuracy of the approximate directivity
+
+The precedence counts are computed exactly, then estimated from several
+fractions of the active time steps. For each fraction, the table gives the
+counting time, the relative error of the counts, the fraction of exact
+counts inside the confidence bounds and, if the ground truth is given, the
+scores of the stacked prediction of main.py.
+
+    python bench_directivity.py -f fluorescence_normal-1.txt \
+        -g network_normal-1.txt --fractions 0.05,0.1,0.25,0.5,1
+"""
+from __future__ import division, print_function, absolute_import
+
+import argparse
+import time
+
+import numpy as np
+
+from directivity import _filter_signals
+from directivity import approximate_precedence_count
+from directivity import precedence_count
+from utils import scale
+
+
+def _timed(function, *args, **kwargs):
+    start = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--fluorescence', type=str, default=None,
+                        help='Path to the fluorescence file, a synthetic '
+                             'recording is used if not given')
+    parser.add_argument('-g', '--ground_truth', type=str, default=None,
+                        help='Path to the network file')
+    parser.add_argument('-m', '--method', type=str, default="simple",
+                        choices=["simple", "tuned"])
+    parser.add_argument('--fractions', type=str, default="0.05,0.1,0.25,1")
+    parser.add_argument('--sampling', type=str, default="random",
+                        choices=["random", "stratified"])
+    parser.add_argument('--n_samples', type=int, default=20000)
+    parser.add_argument('--n_nodes', type=int, default=100)
+    parser.add_argument('-j', '--n_jobs', type=int, default=1)
+    args = vars(parser.parse_args())
+
+    if args["fluorescence"] is not None:
+        from main import load_fluorescence
+        X = load_fluorescence(args["fluorescence"], network=None)
+    else:
+        rng = np.random.RandomState(0)
+        X = (rng.rand(args["n_samples"], args["n_nodes"]) ** 8
+             ).astype(np.float32)
+
+    X_new = _filter_signals(X, threshold=0.12)
+    exact, exact_time = _timed(precedence_count, X_new,
+                               n_jobs=args["n_jobs"])
+    off_diagonal = ~np.eye(exact.shape[0], dtype=bool)
+
+    if args["ground_truth"] is not None:
+        from PCA import make_simple_inference, make_tuned_inference
+        from analyse import METRICS
+        from main import stack
+        from utils import load_network
+
+        y_true = load_network(args["ground_truth"],
+                              n_nodes=X.shape[1]).ravel()
+        if args["method"] == "tuned":
+            y_pca = make_tuned_inference(X)
+        else:
+            y_pca = make_simple_inference(X)
+
+        def evaluate(count):
+            score = stack(y_pca, scale(count - count.T))
+            return dict((name, metric(y_true, score.ravel()))
+                        for name, metric in METRICS.items())
+    else:
+        def evaluate(count):
+            return {}
+
+    print("%s x %s recording, %s sampling, %.1f%% active time steps"
+          % (X.shape[0], X.shape[1], args["sampling"],
+             100. * (X_new[1:].max(axis=1) > 0.2).mean()))
+
+    rows = [("exact", exact_time, 0., 1., evaluate(exact))]
+    for fraction in map(float, args["fractions"].split(",")):
+        (count, bound), duration = _timed(
+            approximate_precedence_count, X_new, fraction,
+            sampling=args["sampling"], random_state=0, n_jobs=args["n_jobs"])
+        error = np.linalg.norm(count - exact) / np.linalg.norm(exact)
+        covered = (np.abs(count - exact) <= bound)[off_diagonal].mean()
+        rows.append((fraction, duration, error, covered, evaluate(count)))
+
+    metric_names = sorted(rows[0][4])
+    print("%-9s %9s %9s %9s" % ("fraction", "time", "rel_err", "coverage") +
+          "".join(" %24s" % name for name in metric_names))
+    for fraction, duration, error, covered, metrics in rows:
+        print("%-9s %8.2fs %9.4f %9.3f" % (fraction, duration, error, covered)
+              + "".join(" %24.5f" % metrics[name] for name in metric_names))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+# Authors: Aaron Qiu <zqiu@ulg.ac.be>,
+#          Antonio Sutera <a.sutera@ulg.ac.be>,
+#          Arnaud Joly <a.joly@ulg.ac.be>,
+#          Gilles Louppe <g.louppe@ulg.ac.be>,
+#          Vincent Francois <v.francois@ulg.ac.be>
+#
+# License: BSD 3 clause
+"""Memory layout of the filtering pipeline
+
+With --check, each stage of the filtering pipeline is run on a row-major
+recording while tracing numpy allocations. A stage fails if its peak
+memory, beyond the array it returns, reaches half the recording, i.e. if
+it makes a hidden full-array copy. The exit code is non zero on failure.
+
+Otherwise, the simplified and tuned filters are timed on a recording of
+the challenge size, with the former pipeline (column-major input,
+np.roll, frame by frame weighting) and with the current one on
+column-major and row-major input. The current pipeline always works in
+row-major order, its results differ from the former ones by the round-off
+of the frame sums, whose summation order depended on the layout.
+
+    python bench_layout.py --check
+    python bench_layout.py --n_samples 179500 --n_nodes 1000
+"""
+from __future__ import division, print_function, absolute_import
+
+import argparse
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from PCA import f1, f2, f3, f4, g, h, r, w, w_star
+from PCA import simple_filter, tuned_filter
+
+# Stages as (name, function, whether the stage returns a new array)
+STAGES = [("f1", f1, True),
+          ("f2", f2, True),
+          ("f3", f3, True),
+          ("f4", f4, True),
+          ("g", g, True),
+          ("h", lambda X: h(X, copy=False), False),
+          ("r", lambda X: r(X, copy=False), False),
+          ("w", w, False),
+          ("w_star", w_star, False)]
+
+
+def check_stages(X):
+    """Peak extra memory of each stage, as a fraction of X.nbytes"""
+    results = []
+    for name, stage, allocates in STAGES:
+        X_stage = X.copy()
+        tracemalloc.start()
+        X_new = stage(X_stage)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        extra = peak - (X_new.nbytes if allocates else 0)
+        results.append((name, X_new.flags.c_contiguous, extra / X.nbytes))
+        del X_stage, X_new
+    return results
+
+
+def _former_w(X):
+    Sum4 = np.sum(X, axis=1)
+    for i in range(X.shape[0]):
+        if Sum4[i] != 0:
+            X[i, :] = ((X[i, :] + 1) ** (1 + (1. / Sum4[i])))
+        else:
+            X[i, :] = 1
+    return X
+
+
+def _former_w_star(X):
+    Sum_X = np.sum(X, axis=1)
+    Sum4 = Sum_X + 0.5 * np.roll(Sum_X, 1)
+    normalization = np.max(Sum4)
+    for i in range(X.shape[0]):
+        ratio = Sum4[i] / normalization
+        if Sum4[i] == 0:
+            X[i, :] = 1
+        elif 0.05 < ratio < 0.23:
+            X[i, :] = ((X[i, :] + 1) ** (1 + (1. / Sum4[i]))) ** 1.9
+        elif 0. < ratio < 0.75:
+            X[i, :] = ((X[i, :] + 1) ** (1 + (1. / Sum4[i]))) ** 1.6
+        else:
+            X[i, :] = ((X[i, :] + 1) ** (1 + (1. / Sum4[i]))) ** 1.4
+    return X
+
+
+def _former_filter(X, tuned):
+    """The former f1 pipeline: np.roll copies, new arrays at each stage and
+    frame by frame weighting on column-major signals."""
+    X = X + np.roll(X, -1, axis=0) + np.roll(X, 1, axis=0)
+    X = np.diff(X, axis=0)
+    X_new = np.zeros_like(X)
+    X_new[X >= 0.11] = X[X >= 0.11]
+    if tuned:
+        return _former_w_star(X_new ** 0.9)
+    return _former_w(X_new)
+
+
+def _timed(function, X):
+    start = time.time()
+    X_new = function(X)
+    return X_new, time.time() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--check', default=False, action="store_true",
+                        help='Check that no stage makes a full-array copy')
+    parser.add_argument('--n_samples', type=int, default=179500)
+    parser.add_argument('--n_nodes', type=int, default=1000)
+    args = vars(parser.parse_args())
+
+    rng = np.random.RandomState(0)
+    X = (rng.rand(args["n_samples"], args["n_nodes"]) ** 8
+         ).astype(np.float32)
+
+    if args["check"]:
+        failed = False
+        print("%-8s %10s %12s" % ("stage", "C order", "extra / X"))
+        for name, c_contiguous, extra in check_stages(X):
+            ok = c_contiguous and extra < 0.5
+            failed = failed or not ok
+            print("%-8s %10s %12.3f %s" % (name, c_contiguous, extra,
+                                            "ok" if ok else "FAILED"))
+        sys.exit(1 if failed else 0)
+
+    X_fortran = np.asfortranarray(X)
+    print("%s x %s recording" % X.shape)
+    for method, filter_ in [("simple", simple_filter), ("tuned", tuned_filter)]:
+        tuned = method == "tuned"
+        reference, former = _timed(lambda X: _former_filter(X, tuned),
+                                   X_fortran)
+        for layout, X_layout in [("F", X_fortran), ("C", X)]:
+            X_new, duration = _timed(filter_, X_layout)
+            print("%-6s former %7.2fs, current on %s order %7.2fs "
+                  "(x%.1f), max difference %.2g"
+                  % (method, former, layout, duration, former / duration,
+                     np.abs(X_new - reference).max()))
+            del X_new
+        del reference
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+# Authors: Aaron Qiu <zqiu@ulg.ac.be>,
+#          Antonio Sutera <a.sutera@ulg.ac.be>,
+#          Arnaud Joly <a.joly@ulg.ac.be>,
+#          Gilles Louppe <g.louppe@ulg.ac.be>,
+#          Vincent Francois <v.francois@ulg.ac.be>
+#
+# License: BSD 3 clause
+"""Check the startup time of the scripts against a budget
+
+Each command is run in a fresh interpreter, the best of a few repetitions
+is reported. The exit code is non zero if a command exceeds the budget.
+
+    python bench_startup.py --budget 1.
+"""
+from __future__ import division, print_function, absolute_import
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+MODULES = ["main", "launcher", "analyse", "PCA", "directivity", "hidden",
+           "utils", "streaming", "spectral", "datasets", "server", "batch",
+           "sweep", "outofcore", "resources"]
+
+COMMANDS = ([("import %s" % module, ["-c", "import %s" % module])
+             for module in MODULES] +
+            [("main.py --help", ["main.py", "--help"]),
+             ("launcher.py --dry_run", ["launcher.py", "--dry_run"])])
+
+
+def timeit(args, n_repeat=3):
+    """Best wall clock time of python args"""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    best = float("inf")
+    with open(os.devnull, "w") as devnull:
+        for _ in range(n_repeat):
+            start = time.time()
+            subprocess.check_call([sys.executable] + args, cwd=cwd,
+                                  stdout=devnull)
+            best = min(best, time.time() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--budget', type=float, default=1.,
+                        help='Startup budget in seconds')
+    parser.add_argument('-r', '--n_repeat', type=int, default=3)
+    args = vars(parser.parse_args())
+
+    n_over_budget = 0
+    for name, command in COMMANDS:
+        duration = timeit(command, args["n_repeat"])
+        over_budget = duration > args["budget"]
+        n_over_budget += over_budget
+        print("%-30s %6.3fs%s" % (name, duration,
+                                  " OVER BUDGET" if over_budget else ""))
+
+    sys.exit(n_over_budget > 0)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+# Authors: Aaron Qiu <zqiu@ulg.ac.be>,
+#          Antonio Sutera <a.sutera@ulg.ac.be>,
+#          Arnaud Joly <a.joly@ulg.ac.be>,
+#          Gilles Louppe <g.louppe@ulg.ac.be>,
+#          Vincent Francois <v.francois@ulg.ac.be>
+#
+# License: BSD 3 clause
+"""Throughput of jobs packed on one node with and without a core budget
+
+n_concurrent jobs run the PCA and directivity stages on the same synthetic
+recording at the same time, as the launcher packs them on a shared node.
+In the "naive" mode, every job uses all the cores of the node, both for
+BLAS threads and for directivity processes. In the "budget" mode, each job
+gets n_cores / n_concurrent cores split by resources.plan_layout. As with
+the launcher, the thread environment variables are set when the workers
+start.
+
+The number of cores of the node may be forced with --n_cores, e.g. to
+reproduce the oversubscription of a larger node on a smaller machine.
+
+    python bench_threads.py --n_concurrent 4
+"""
+from __future__ import division, print_function, absolute_import
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+def layout_of(mode, n_cpus, n_cores):
+    from resources import plan_layout
+
+    if mode == "budget":
+        return plan_layout(n_cpus)
+    return {"pca": {"n_jobs": 1, "n_threads": n_cores},
+            "directivity": {"n_jobs": n_cores, "n_threads": n_cores}}
+
+
+def worker(mode, n_cpus, n_cores, n_samples, n_nodes, stages):
+    from PCA import simple_filter
+    from resources import limit_threads
+    from sklearn.decomposition import PCA
+
+    rng = np.random.RandomState(0)
+    X = np.ascontiguousarray(rng.rand(n_samples, n_nodes) ** 8,
+                             dtype=np.float32)
+    layout = layout_of(mode, n_cpus, n_cores)
+
+    def run_pca():
+        X_new = simple_filter(X.copy(), LP="f1")
+        PCA(whiten=True, n_components=int(0.8 * n_nodes)).fit(X_new)
+
+    def run_directivity():
+        from directivity import make_prediction_directivity
+        make_prediction_directivity(X, n_jobs=layout["directivity"]["n_jobs"])
+
+    for stage, run in [("pca", run_pca), ("directivity", run_directivity)]:
+        if stage not in stages:
+            continue
+        with limit_threads(layout[stage]["n_threads"]):
+            run()
+
+
+def run_concurrent(mode, n_concurrent, n_cores, args):
+    from resources import thread_environment
+
+    n_cpus = max(1, n_cores // n_concurrent)
+    command = [sys.executable, __file__, "--worker", "--mode", mode,
+               "--n_cpus", str(n_cpus),
+               "--n_cores", str(n_cores),
+               "--n_samples", str(args["n_samples"]),
+               "--n_nodes", str(args["n_nodes"]),
+               "--stages", args["stages"]]
+
+    # BLAS reads its number of threads when numpy is imported
+    env = dict(os.environ)
+    env.update(thread_environment(
+        layout_of(mode, n_cpus, n_cores)["pca"]["n_threads"]))
+
+    start = time.time()
+    processes = [subprocess.Popen(command, env=env)
+                 for _ in range(n_concurrent)]
+    for process in processes:
+        if process.wait() != 0:
+            raise RuntimeError("Worker failed")
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--worker', default=False, action="store_true")
+    parser.add_argument('--mode', default="budget",
+                        choices=["naive", "budget"])
+    parser.add_argument('--n_cpus', type=int, default=None)
+    parser.add_argument('--n_cores', type=int, default=None,
+                        help='Number of cores of the node, detected if not '
+                             'given')
+    parser.add_argument('-j', '--n_concurrent', type=int, default=4,
+                        help='Number of jobs packed on the node')
+    parser.add_argument('--n_samples', type=int, default=20000)
+    parser.add_argument('--n_nodes', type=int, default=500)
+    parser.add_argument('--stages', type=str, default="pca,directivity")
+    args = vars(parser.parse_args())
+
+    if args["worker"]:
+        worker(args["mode"], args["n_cpus"], args["n_cores"],
+               args["n_samples"], args["n_nodes"], args["stages"].split(","))
+        sys.exit(0)
+
+    from resources import allocated_cpus
+    n_cores = args["n_cores"]
+    if n_cores is None:
+        n_cores = allocated_cpus(args["n_cpus"])
+
+    print("%s jobs on %s cores, %s x %s recording"
+          % (args["n_concurrent"], n_cores, args["n_samples"],
+             args["n_nodes"]))
+    for mode in ["naive", "budget"]:
+        duration = run_concurrent(mode, args["n_concurrent"], n_cores, args)
+        print("%-6s %8.2fs %8.3f jobs/min"
+              % (mode, duration, 60 * args["n_concurrent"] / duration))
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+# Authors: Aaron Qiu <zqiu@ulg.ac.be>,
+#          Antonio Sutera <a.sutera@ulg.ac.be>,
+#          Arnaud Joly <a.joly@ulg.ac.be>,
+#          Gilles Louppe <g.louppe@ulg.ac.be>,
+#          Vincent Francois <v.francois@ulg.ac.be>
+#
+# License: BSD 3 clause
+"""Preparation of the challenge datasets into an indexed binary store
+
+Already downloaded tarballs (see datasets-readme.md) are verified against
+the checksums.txt of their directory, then streamed member by member: each
+fluorescence_*.txt and network_*.txt file is converted directly into a
+numpy array without writing the csv file on disk. A manifest indexes the
+converted recordings.
+
+    python datasets.py datasets/normal-bursting datasets/low-bursting \
+        datasets/high-bursting -j 8
+
+The bursting type is the name of the directory holding the tarballs. The
+store keeps that name as the parent directory of the arrays, so that
+make_hash of main.py is unchanged.
+"""
+from __future__ import division, print_function, absolute_import
+
+import argparse
+import hashlib
+import json
+import os
+import tarfile
+
+import numpy as np
+
+from utils import network_from_edges
+
+WORKING_DIR = os.path.join(os.environ["HOME"],
+                           "scikit_learn_data/connectomics")
+
+STORE_DIR = os.path.join(WORKING_DIR, "store")
+
+TARBALL_EXTENSIONS = (".tar", ".tgz", ".tar.gz")
+
+
+def md5sum(fname, block_size=2 ** 20):
+    """md5 hexdigest of a file read by blocks"""
+    md5 = hashlib.md5()
+    with open(fname, "rb") as fhandle:
+        for block in iter(lambda: fhandle.read(block_size), b""):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def read_checksums(directory):
+    """Map file names to md5 hexdigests from directory/checksums.txt"""
+    checksums = dict()
+    fname = os.path.join(directory, "checksums.txt")
+    if not os.path.exists(fname):
+        return checksums
+
+    with open(fname) as fhandle:
+        for line in fhandle:
+            line = line.strip()
+            if line:
+                digest, path = line.split(None, 1)
+                checksums[os.path.basename(path.lstrip("*"))] = digest
+    return checksums
+
+
+def _member_name(member):
+    """Private function returning the kind and the network name of a
+    tarball member, or None if the member is not a dataset file."""
+    basename = os.path.basename(member.name)
+    for kind in ("fluorescence", "network"):
+        if basename.startswith(kind + "_") and basename.endswith(".txt"):
+            return kind, os.path.splitext(basename)[0].split("_", 1)[1]
+    return None
+
+
+def convert_tarball(tarball, bursting, store_dir=STORE_DIR, digest=None):
+    """Convert the datasets of a tarball into numpy arrays
+
+    Parameters
+    ----------
+    tarball : string
+        Path to the tarball.
+
+    bursting : string
+        Bursting type of the recordings, e.g. "normal-bursting".
+
+    store_dir : string, optional (default=STORE_DIR)
+        Root directory of the binary store.
+
+    digest : string or None, optional (default=None)
+        Expected md5 hexdigest of the tarball. If None, no verification.
+
+    Returns
+    -------
+    entries : list of dict
+        Manifest entries of the converted recordings.
+
+    """
+    if digest is not None and md5sum(tarball) != digest:
+        raise ValueError("Checksum mismatch for %s" % tarball)
+
+    output_dir = os.path.join(store_dir, bursting)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    fluorescence = dict()
+    networks = dict()
+
+    # Stream the tarball, members are only read once and in order
+    with tarfile.open(tarball, mode="r|*") as archive:
+        for member in archive:
+            name = _member_name(member) if member.isfile() else None
+            if name is None:
+                continue
+
+            kind, network = name
+            data = np.loadtxt(archive.extractfile(member), delimiter=",")
+
+            if kind == "fluorescence":
+                path = os.path.join(output_dir, "fluorescence_%s.npy"
+                                                % network)
+                np.save(path, data.astype(np.float32))
+                fluorescence[network] = (path, data.shape)
+            else:
+                # Networks are small, they wait for their number of nodes
+                networks[network] = data
+
+    entries = []
+    for network, (path, (n_samples, n_nodes)) in sorted(fluorescence.items()):
+        entry = {"network": network,
+                 "bursting": bursting,
+                 "n_nodes": n_nodes,
+                 "n_samples": n_samples,
+                 "fluorescence": path,
+                 "ground_truth": None,
+                 "tarball": os.path.basename(tarball)}
+
+        if network in networks:
+            entry["ground_truth"] = os.path.join(output_dir, "network_%s.npy"
+                                                             % network)
+            np.save(entry["ground_truth"],
+                    network_from_edges(networks[network], n_nodes))
+
+        entries.append(entry)
+
+    return entries
+
+
+def find_tarballs(directory):
+    return sorted(os.path.join(directory, fname)
+                  for fname in os.listdir(directory)
+                  if fname.endswith(TARBALL_EXTENSIONS))
+
+
+def load_manifest(store_dir=STORE_DIR):
+    """Load the list of manifest entries of a store"""
+    fname = os.path.join(store_dir, "manifest.json")
+    if not os.path.exists(fname):
+        return []
+
+    with open(fname) as fhandle:
+        return json.load(fhandle)
+
+
+def save_manifest(entries, store_dir=STORE_DIR):
+    fname = os.path.join(store_dir, "manifest.json")
+    tmp_fname = fname + ".tmp"
+    with open(tmp_fname, "w") as fhandle:
+        json.dump(entries, fhandle, indent=1, sort_keys=True)
+    os.rename(tmp_fname, fname)
+
+
+def query_manifest(entries, **criteria):
+    """Select manifest entries matching all criteria
+
+    A criterion is either a value or a callable, e.g.
+    query_manifest(entries, bursting="low-bursting",
+                   n_nodes=lambda n: n <= 100).
+    """
+    def match(entry, key, value):
+        if callable(value):
+            return value(entry[key])
+        return entry[key] == value
+
+    return [entry for entry in entries
+            if all(match(entry, key, value)
+                   for key, value in criteria.items())]
+
+
+def prepare(directories, store_dir=STORE_DIR, n_jobs=1, verbose=True):
+    """Verify and convert all tarballs of the given directories
+
+    Returns the updated manifest, also saved in store_dir.
+    """
+    from sklearn.externals.joblib import Parallel, delayed
+
+    tasks = []
+    for directory in directories:
+        bursting = os.path.basename(os.path.normpath(directory))
+        checksums = read_checksums(directory)
+
+        for tarball in find_tarballs(directory):
+            digest = checksums.get(os.path.basename(tarball))
+            if digest is None and verbose:
+                print("No checksum for %s" % tarball)
+            tasks.append((tarball, bursting, digest))
+
+    all_entries = Parallel(n_jobs=n_jobs, verbose=verbose)(
+        delayed(convert_tarball)(tarball, bursting, store_dir, digest)
+        for tarball, bursting, digest in tasks)
+
+    # Update the manifest, new entries replace the old ones
+    manifest = dict(((entry["bursting"], entry["network"]), entry)
+                    for entry in load_manifest(store_dir))
+    for entries in all_entries:
+        for entry in entries:
+            manifest[(entry["bursting"], entry["network"])] = entry
+
+    manifest = [manifest[key] for key in sorted(manifest)]
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    save_manifest(manifest, store_dir)
+
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directories', nargs="+",
+                        help='Directories with downloaded tarballs')
+    parser.add_argument('-o', '--store_dir', type=str, default=STORE_DIR,
+                        help='Root directory of the binary store')
+    parser.add_argument('-j', '--n_jobs', type=int, default=1,
+                        help='Number of tarballs processed in parallel')
+    args = vars(parser.parse_args())
+
+    manifest = prepare(args["directories"], store_dir=args["store_dir"],
+                       n_jobs=args["n_jobs"])
+    print("%s recordings indexed in %s" % (len(manifest),
+                                           args["store_dir"]))
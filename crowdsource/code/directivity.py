@@ -10,8 +10,8 @@ from __future__ import division, print_function, absolute_import
 from itertools import chain
 
 import numpy as np
-from sklearn.externals.joblib import Parallel, delayed, cpu_count
 
+from resources import allocated_cpus
 from utils import scale
 
 
@@ -20,7 +20,7 @@ def _partition_X(X, n_jobs):
     n_nodes = X.shape[1]
 
     # Compute the number of jobs
-    n_jobs = min(cpu_count() if n_jobs == -1 else n_jobs, n_nodes)
+    n_jobs = min(allocated_cpus() if n_jobs == -1 else n_jobs, n_nodes)
 
     # Partition estimators between jobs
     n_node_per_job = (n_nodes // n_jobs) * np.ones(n_jobs, dtype=np.int)
@@ -30,25 +30,196 @@ def _partition_X(X, n_jobs):
     return n_jobs, [0] + starts.tolist()
 
 
-def _parallel_count(X, start, end):
-    """Private function used to compute a batch of score within a job."""
-    count = np.zeros((end - start, X.shape[1]))
+def _parallel_count(X_prev, X_next, start, end, weights=None):
+    """Private function used to compute a batch of score within a job.
+
+    Row t of X_next is the frame following row t of X_prev. If given,
+    weights are the weights of the time steps in the count.
+    """
+    count = np.zeros((end - start, X_prev.shape[1]))
 
     for index, jx in enumerate(range(start, end)):
-        X_jx_bot = X[:-1, jx] + 0.2
-        X_jx_top = X[:-1, jx] + 0.5
+        X_jx_bot = X_prev[:, jx] + 0.2
+        X_jx_top = X_prev[:, jx] + 0.5
 
-        for j in range(X.shape[1]):
+        for j in range(X_prev.shape[1]):
             if j == jx:
                 continue
 
-            count[index, j] = ((X[1:, j] > X_jx_bot) &
-                               (X[1:, j] < X_jx_top)).sum()
+            events = (X_next[:, j] > X_jx_bot) & (X_next[:, j] < X_jx_top)
+            if weights is None:
+                count[index, j] = events.sum()
+            else:
+                count[index, j] = np.dot(events, weights)
 
     return count
 
 
-def make_prediction_directivity(X, threshold=0.12, n_jobs=1):
+def _hard_threshold(X_new, threshold):
+    """Private function zeroing values below threshold and raising the
+    others to the power 0.9, in place."""
+    thresh1 = X_new < threshold * 1
+    thresh2 = X_new >= threshold * 1
+    X_new[thresh1] = 0
+    X_new[thresh2] = pow(X_new[thresh2], 0.9)
+    return X_new
+
+
+def precedence_count(X_new, n_jobs=1):
+    """Count, for each pair of neurons, the precedence events
+
+    count[i, j] is the number of time steps t such that
+    X_new[t, i] + 0.2 < X_new[t + 1, j] < X_new[t, i] + 0.5.
+
+    Parameters
+    ----------
+    X_new : numpy array of shape (n_samples, n_nodes)
+        Filtered fluorescence signals.
+
+    n_jobs : integer, optional (default=1)
+        The number of jobs to run the algorithm in parallel.
+        If -1, then the number of jobs is set to the number of allocated
+        cores (see resources.allocated_cpus).
+
+    Returns
+    -------
+    count : numpy array of shape (n_nodes, n_nodes)
+        Pairwise precedence counts.
+
+    """
+    from sklearn.externals.joblib import Parallel, delayed
+
+    n_jobs, starts = _partition_X(X_new, n_jobs)
+    all_counts = Parallel(n_jobs=n_jobs)(
+        delayed(_parallel_count)(X_new[:-1], X_new[1:], starts[i],
+                                 starts[i + 1])
+        for i in range(n_jobs))
+    return np.vstack(list(chain.from_iterable(all_counts)))
+
+
+def active_transitions(X_new):
+    """Time steps t which may contribute to the precedence counts
+
+    As the thresholded signals are non negative, a precedence event from
+    t to t + 1 requires a value above 0.2 at t + 1. Other time steps have
+    no event for any pair of neurons.
+    """
+    return np.flatnonzero(X_new[1:].max(axis=1) > 0.2)
+
+
+def approximate_precedence_count(X_new, sample_fraction=0.1,
+                                 sampling="random", confidence=0.95,
+                                 random_state=None, n_jobs=1):
+    """Estimate the precedence counts from a subset of time steps
+
+    Only the active time steps (see active_transitions) are considered, of
+    which a fraction is drawn without replacement. The counts of the drawn
+    time steps are scaled to all active time steps, which is unbiased.
+    With sample_fraction=1, the counts are exact.
+
+    Parameters
+    ----------
+    X_new : numpy array of shape (n_samples, n_nodes)
+        Filtered fluorescence signals, non negative.
+
+    sample_fraction : float, optional (default=0.1)
+        Fraction of the active time steps used in the estimate.
+
+    sampling : "random" or "stratified", optional (default="random")
+        Draw the time steps uniformly at random, or draw one time step in
+        each of the contiguous strata of equal size of the recording.
+
+    confidence : float, optional (default=0.95)
+        Confidence level of the bounds.
+
+    random_state : int, RandomState instance or None, optional (default=None)
+        Seed of the sampling.
+
+    n_jobs : integer, optional (default=1)
+        The number of jobs to run the algorithm in parallel.
+        If -1, then the number of jobs is set to the number of allocated
+        cores (see resources.allocated_cpus).
+
+    Returns
+    -------
+    count : numpy array of shape (n_nodes, n_nodes)
+        Estimated pairwise precedence counts.
+
+    bound : numpy array of shape (n_nodes, n_nodes)
+        Half width of the confidence interval of each count, from the
+        normal approximation of the proportion of time steps with an event
+        (Agresti-Coull) with finite population correction. For stratified
+        sampling, this is the bound of random sampling, it is only
+        approximate as the variance within strata is not estimated.
+
+    """
+    from scipy.stats import norm
+    from sklearn.externals.joblib import Parallel, delayed
+    from sklearn.utils import check_random_state
+
+    if not 0 < sample_fraction <= 1:
+        raise ValueError("sample_fraction should be in (0, 1], got %s"
+                         % sample_fraction)
+    if sampling not in ["random", "stratified"]:
+        raise ValueError("Unknown sampling, got %s." % sampling)
+
+    random_state = check_random_state(random_state)
+    n_nodes = X_new.shape[1]
+
+    active = active_transitions(X_new)
+    n_active = len(active)
+    n_drawn = min(n_active, int(np.ceil(sample_fraction * n_active)))
+    if n_drawn == 0:
+        return np.zeros((n_nodes, n_nodes)), np.zeros((n_nodes, n_nodes))
+
+    weights = None
+    if n_drawn == n_active:
+        drawn = active
+    elif sampling == "random":
+        drawn = np.sort(random_state.choice(active, n_drawn, replace=False))
+    else:
+        # Strata sizes differ by at most one, each drawn time step stands
+        # for its stratum.
+        edges = np.linspace(0, n_active, n_drawn + 1).astype(int)
+        sizes = np.diff(edges)
+        drawn = active[edges[:-1] +
+                       (random_state.rand(n_drawn) * sizes).astype(int)]
+        weights = sizes * n_drawn / n_active
+
+    n_jobs, starts = _partition_X(X_new, n_jobs)
+    all_counts = Parallel(n_jobs=n_jobs)(
+        delayed(_parallel_count)(X_new[drawn], X_new[drawn + 1], starts[i],
+                                 starts[i + 1], weights)
+        for i in range(n_jobs))
+    count = np.vstack(list(chain.from_iterable(all_counts)))
+
+    if n_drawn == n_active:
+        return count, np.zeros_like(count)
+
+    z = norm.ppf(0.5 + confidence / 2.)
+    proportion = (count + z ** 2 / 2.) / (n_drawn + z ** 2)
+    correction = (n_active - n_drawn) / (n_active - 1.)
+    bound = n_active * z * np.sqrt(proportion * (1. - proportion) /
+                                   (n_drawn + z ** 2) * correction)
+    np.fill_diagonal(bound, 0.)
+
+    return count * n_active / n_drawn, bound
+
+
+def _filter_signals(X, threshold):
+    """Private function filtering and thresholding the signals."""
+    X_new = np.zeros((X.shape))
+    for i in range(1, X.shape[0] - 1):
+        for j in range(X.shape[1]):
+            X_new[i, j] = (X[i, j] + 1 * X[i - 1, j] + 0.8 * X[i - 2, j] +
+                           0.4 * X[i - 3, j])
+
+    return _hard_threshold(np.diff(X_new, axis=0), threshold)
+
+
+def make_prediction_directivity(X, threshold=0.12, n_jobs=1,
+                                sample_fraction=None, sampling="random",
+                                random_state=None):
     """Score neuron connectivity using a precedence measure
 
     Parameters
@@ -62,7 +233,18 @@ def make_prediction_directivity(X, threshold=0.12, n_jobs=1):
 
     n_jobs : integer, optional (default=1)
         The number of jobs to run the algorithm in parallel.
-        If -1, then the number of jobs is set to the number of cores.
+        If -1, then the number of jobs is set to the number of allocated
+        cores (see resources.allocated_cpus).
+
+    sample_fraction : float or None, optional (default=None)
+        If given, the precedence counts are estimated from this fraction
+        of the time steps (see approximate_precedence_count).
+
+    sampling : "random" or "stratified", optional (default="random")
+        Sampling of the time steps if sample_fraction is given.
+
+    random_state : int, RandomState instance or None, optional (default=None)
+        Seed of the sampling if sample_fraction is given.
 
     Returns
     -------
@@ -72,23 +254,14 @@ def make_prediction_directivity(X, threshold=0.12, n_jobs=1):
     """
 
     # Perform filtering
-    X_new = np.zeros((X.shape))
-    for i in range(1, X.shape[0] - 1):
-        for j in range(X.shape[1]):
-            X_new[i, j] = (X[i, j] + 1 * X[i - 1, j] + 0.8 * X[i - 2, j] +
-                           0.4 * X[i - 3, j])
-
-    X_new = np.diff(X_new, axis=0)
-    thresh1 = X_new < threshold * 1
-    thresh2 = X_new >= threshold * 1
-    X_new[thresh1] = 0
-    X_new[thresh2] = pow(X_new[thresh2], 0.9)
+    X_new = _filter_signals(X, threshold)
 
     # Score directivity
-    n_jobs, starts = _partition_X(X, n_jobs)
-    all_counts = Parallel(n_jobs=n_jobs)(
-        delayed(_parallel_count)(X_new, starts[i], starts[i + 1])
-        for i in range(n_jobs))
-    count = np.vstack(list(chain.from_iterable(all_counts)))
+    if sample_fraction is None:
+        count = precedence_count(X_new, n_jobs=n_jobs)
+    else:
+        count, _ = approximate_precedence_count(
+            X_new, sample_fraction, sampling=sampling,
+            random_state=random_state, n_jobs=n_jobs)
 
-    return scale(count - np.transpose(count))
+    return scale(count - np.transpose(count), copy=False)
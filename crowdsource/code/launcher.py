@@ -5,55 +5,94 @@ import shlex
 from pprint import pprint
 from collections import defaultdict
 
-from sklearn.grid_search import ParameterGrid
-
-from clusterlib.scheduler import queued_or_running_jobs
-from clusterlib.scheduler import submit
-from clusterlib.storage import sqlite3_loads
-
+from datasets import load_manifest
 from main import WORKING_DIR
 from main import make_hash
 from main import parse_arguments
 from main import get_sqlite3_path
+from resources import thread_environment
+from utils import expand_grid
 
 
 # Make the grid of parameters to evaluate -------------------------------------
 
+DATASET_DIRECTORIES = [os.path.join(WORKING_DIR, "datasets"),
+                       os.path.join(WORKING_DIR, "datasets", "normal-bursting"),
+                       os.path.join(WORKING_DIR, "datasets", "low-bursting"),
+                       os.path.join(WORKING_DIR, "datasets", "high-bursting")]
 
-ALL_FLUORESCENCE = []
-for directory in [os.path.join(WORKING_DIR, "datasets"),
-                  os.path.join(WORKING_DIR, "datasets", "normal-bursting"),
-                  os.path.join(WORKING_DIR, "datasets", "low-bursting"),
-                  os.path.join(WORKING_DIR, "datasets", "high-bursting")]:
-    if os.path.exists(directory):
-        for path in os.listdir(directory):
-            if path.startswith("fluorescence_"):
-                ALL_FLUORESCENCE.append(os.path.join(directory, path))
+OUTPUT_DIR = os.path.join(WORKING_DIR, "submission")
 
-ALL_NETWORKS = [os.path.basename(os.path.splitext(x)[0]).split("_", 1)[1]
-                for x in ALL_FLUORESCENCE]
+# Number of strongest edges kept by the sparse top_k jobs (see main.py).
+# Each value reruns the inference of every dense job, so sparse jobs are
+# opt-in, e.g. TOP_K = [10000].
+TOP_K = []
 
 
-OUTPUT_DIR = os.path.join(WORKING_DIR, "submission")
+def list_fluorescence():
+    """List all fluorescence files
+
+    Recordings indexed in the manifest of the binary store (see datasets.py)
+    are taken from there, only the other dataset directories are scanned.
+    """
+    manifest = load_manifest()
+    indexed = set(entry["bursting"] for entry in manifest)
+    all_fluorescence = [entry["fluorescence"] for entry in manifest]
+
+    for directory in DATASET_DIRECTORIES:
+        if os.path.basename(directory) in indexed:
+            continue
+        if os.path.exists(directory):
+            for path in os.listdir(directory):
+                if path.startswith("fluorescence_"):
+                    all_fluorescence.append(os.path.join(directory, path))
+
+    return all_fluorescence
+
 
-NORMAL = [{"output_dir": [OUTPUT_DIR],
-           "network": [network],
-           "fluorescence": [fluorescence],
-           "method": ["simple", "tuned"],
-           "directivity": [0, 1]}
-          for fluorescence, network in zip(ALL_FLUORESCENCE, ALL_NETWORKS)]
+_PARAMETER_GRID = None
 
-HIDDEN_NEURON = [{"output_dir": [OUTPUT_DIR],
-                  "network": [network],
-                  "fluorescence": [fluorescence],
-                  "method": ["simple", "tuned"],
-                  "directivity": [0, 1],
-                  "killing": range(1, 11)}
-                 for fluorescence, network in zip(ALL_FLUORESCENCE,
-                                                  ALL_NETWORKS)
-                 if network in ("normal-3", "normal-4")]
 
-PARAMETER_GRID = ParameterGrid(NORMAL + HIDDEN_NEURON)
+def get_parameter_grid():
+    """List of all job parameters, built once on first use"""
+    global _PARAMETER_GRID
+
+    if _PARAMETER_GRID is None:
+        all_fluorescence = list_fluorescence()
+        all_networks = [
+            os.path.basename(os.path.splitext(x)[0]).split("_", 1)[1]
+            for x in all_fluorescence]
+
+        normal = [{"output_dir": [OUTPUT_DIR],
+                   "network": [network],
+                   "fluorescence": [fluorescence],
+                   "method": ["simple", "tuned"],
+                   "directivity": [0, 1]}
+                  for fluorescence, network in zip(all_fluorescence,
+                                                   all_networks)]
+
+        hidden_neuron = [{"output_dir": [OUTPUT_DIR],
+                          "network": [network],
+                          "fluorescence": [fluorescence],
+                          "method": ["simple", "tuned"],
+                          "directivity": [0, 1],
+                          "killing": range(1, 11)}
+                         for fluorescence, network in zip(all_fluorescence,
+                                                          all_networks)
+                         if network in ("normal-3", "normal-4")]
+
+        sparse = [{"output_dir": [OUTPUT_DIR],
+                   "network": [network],
+                   "fluorescence": [fluorescence],
+                   "method": ["simple", "tuned"],
+                   "directivity": [0, 1],
+                   "top_k": TOP_K}
+                  for fluorescence, network in zip(all_fluorescence,
+                                                   all_networks)]
+
+        _PARAMETER_GRID = list(expand_grid(normal + hidden_neuron + sparse))
+
+    return _PARAMETER_GRID
 
 
 # Useful constant for the job launch -------------------------------------
@@ -66,6 +105,7 @@ CLUSTER_MAX_N_JOBS = 1000
 
 JOB_MIN_MEMORY = 4000
 JOB_MIN_TIME = 24
+JOB_N_CPUS = 1
 
 
 def select_queue(memory, time):
@@ -144,9 +184,24 @@ if __name__ == "__main__":
     parser.add_argument('-v', '--verbose', default=False, action="store_true")
     parser.add_argument('-l', '--logs', default=False, action="store_true",
                         help="Show log if any")
+    parser.add_argument('-n', '--dry_run', default=False,
+                        action="store_true",
+                        help="Only count the jobs of the parameter grid")
 
     args = vars(parser.parse_args())
 
+    if args["dry_run"]:
+        parameter_grid = get_parameter_grid()
+        if args["verbose"]:
+            for parameters in parameter_grid:
+                print(make_hash(parameters))
+        print("n_total_jobs = %s" % len(parameter_grid))
+        sys.exit(0)
+
+    from clusterlib.scheduler import queued_or_running_jobs
+    from clusterlib.scheduler import submit
+    from clusterlib.storage import sqlite3_loads
+
     # Create log direcotyr if needed
     if not os.path.exists(LOG_DIRECTORY):
         os.makedirs(LOG_DIRECTORY)
@@ -158,7 +213,8 @@ if __name__ == "__main__":
     n_jobs_done = 0
     to_launch = dict()
 
-    for parameters in PARAMETER_GRID:
+    parameter_grid = get_parameter_grid()
+    for parameters in parameter_grid:
         job_hash = make_hash(parameters)
 
         if job_hash in all_jobs_done:
@@ -193,7 +249,12 @@ if __name__ == "__main__":
             raise ValueError("hash are not equal, all parameters are "
                              "not specified.")
 
-        cmd = submit(job_command=" ".join([sys.executable,
+        # BLAS reads its number of threads when numpy is imported
+        thread_variables = " ".join(
+            "%s=%s" % item
+            for item in sorted(thread_environment(JOB_N_CPUS).items()))
+        cmd = submit(job_command=" ".join(["env", thread_variables,
+                                           sys.executable,
                                            os.path.abspath("main.py"),
                                            cmd_parameters]),
                      job_name=job_hash,
@@ -203,6 +264,8 @@ if __name__ == "__main__":
                      backend="slurm")
 
         cmd += select_queue(memory[job_hash], time[job_hash])
+        # main.py reads its number of cores from SLURM_CPUS_PER_TASK
+        cmd += " --cpus-per-task=%s " % JOB_N_CPUS
 
         if not args["debug"]:
             os.system(cmd)
@@ -218,5 +281,5 @@ if __name__ == "__main__":
     print("n_jobs_done = %s" % n_jobs_done)
     print("n_jobs_launched = %s" % n_jobs_launched)
     print("n_jobs_remaining = %s" %
-          (len(PARAMETER_GRID) - n_jobs_running - n_jobs_done, ))
-    print("n_total_jobs = %s" % len(PARAMETER_GRID))
+          (len(parameter_grid) - n_jobs_running - n_jobs_done, ))
+    print("n_total_jobs = %s" % len(parameter_grid))
@@ -12,17 +12,17 @@ from __future__ import division, print_function, absolute_import
 
 import os
 import argparse
+from functools import partial
 from itertools import product
 from pprint import pprint
 
 import numpy as np
 
-from PCA import make_simple_inference, make_tuned_inference
-from directivity import make_prediction_directivity
 from hidden import kill
+from utils import save_top_k
 
-# Cache accelerator may be removed to save disk space
-from clusterlib.storage import sqlite3_dumps
+# scikit-learn and clusterlib are imported when needed, so that importing
+# this module or parsing arguments stays fast.
 
 WORKING_DIR = os.path.join(os.environ["HOME"],
                            "scikit_learn_data/connectomics")
@@ -38,6 +38,16 @@ def make_hash(args):
     job_hash = "%(network)s-m=%(method)s-d=%(directivity)s" % args
     if "killing" in args:
         job_hash += "-k=%(killing)s" % args
+    if "tol" in args:
+        job_hash += "-tol=%(tol)s" % args
+    if "directivity_fraction" in args:
+        job_hash += "-df=%(directivity_fraction)s" % args
+        if "directivity_sampling" in args:
+            job_hash += "-%(directivity_sampling)s" % args
+    if "top_k" in args:
+        job_hash += "-top=%(top_k)s" % args
+        if args.get("per_node"):
+            job_hash += "pn"
 
     if "bursting" in args["fluorescence"]:
         job_hash += "-b=%s" % args["fluorescence"].split("/")[-2]
@@ -64,60 +74,182 @@ def parse_arguments(args=None):
     parser.add_argument('-k', '--killing', type=int, required=False,
                         choices=[1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
                         help='Should we "kill" some neurons?')
-    return vars(parser.parse_args(args))
+    parser.add_argument('-t', '--tol', type=float, required=False,
+                        help='Stop aggregating the ensemble once the top '
+                             'edges overlap of two successive checks is '
+                             'at least 1 - tol')
+    parser.add_argument('-K', '--top_k', type=int, required=False,
+                        help='Only save the top_k strongest edges with their '
+                             'rank in a sparse .npz file')
+    parser.add_argument('--per_node', type=int, required=False,
+                        choices=[0, 1],
+                        help='Select the top_k strongest edges per neuron '
+                             'instead of overall?')
+    parser.add_argument('--directivity_fraction', type=float,
+                        required=False,
+                        help='Estimate the directivity from this fraction '
+                             'of the active time steps (in-memory only)')
+    parser.add_argument('--directivity_sampling', type=str, required=False,
+                        choices=["random", "stratified"],
+                        help='Sampling of the time steps with '
+                             '--directivity_fraction (default: random)')
+    parser.add_argument('-c', '--n_cpus', type=int, required=False,
+                        help='Number of allocated cores, read from the '
+                             'scheduler environment if not given')
+    parser.add_argument('--chunk_size', type=int, required=False,
+                        help='Read the recording by chunks of chunk_size '
+                             'frames instead of loading it in memory')
+    args = parser.parse_args(args)
+
+    if "chunk_size" in args and "tol" in args:
+        parser.error("--tol is not available with --chunk_size, the whole "
+                     "ensemble is aggregated")
+    if "chunk_size" in args and "directivity_fraction" in args:
+        parser.error("--directivity_fraction is not available with "
+                     "--chunk_size")
+    if ("directivity_sampling" in args and
+            "directivity_fraction" not in args):
+        parser.error("--directivity_sampling requires --directivity_fraction")
+
+    return vars(args)
+
+
+def load_fluorescence(fluorescence, network, killing=None):
+    """Load fluorescence signals, removing killed neurons if any"""
+    if fluorescence.endswith(".npy"):
+        X = np.load(fluorescence)
+    else:
+        X = np.loadtxt(fluorescence, delimiter=",")
+    # Frames contiguous in memory for the filters (see PCA.CHUNK_ROWS)
+    X = np.ascontiguousarray(X, dtype=np.float32)
+
+    # Should we remove some neurons?
+    if killing is not None:
+        X = kill_neurons(X, network, killing)
+
+    return X
+
+
+def kill_neurons(X, network, killing):
+    """Remove the neurons killed in the hidden neuron experiment"""
+    if network not in ["normal-3", "normal-4"]:
+        raise ValueError("No killing specified for %s" % network)
+    return kill(X, network, killing)
+
+
+def stack(y_pca, y_directivity):
+    """Stack the partial correlation and the directivity scores"""
+    return 0.997 * y_pca + 0.003 * y_directivity
+
+
+def write_submission(score, name, outname):
+    """Write the connectivity score in the challenge submission format"""
+    with open(outname, 'w') as fname:
+        fname.write("NET_neuronI_neuronJ,Strength\n")
+
+        for i, j in product(range(score.shape[0]), range(score.shape[1])):
+            line = "{0}_{1}_{2},{3}\n".format(name, i + 1, j + 1,
+                                              score[i, j])
+            fname.write(line)
+
+
+def save_prediction(score, args, job_hash):
+    """Save the score as main.py does, returns the path of the file
+
+    The top_k strongest edges are saved in a sparse .npz file if top_k is
+    given, the whole score in the challenge submission format otherwise.
+    """
+    if not os.path.exists(args["output_dir"]):
+        os.makedirs(args["output_dir"])
+
+    if "top_k" in args:
+        outname = os.path.join(args["output_dir"], "%s.npz" % job_hash)
+        save_top_k(outname, score, args["top_k"],
+                   per_node=args.get("per_node", 0))
+    else:
+        outname = os.path.join(args["output_dir"], "%s.csv" % job_hash)
+
+        # Generate the submission file ##
+        write_submission(score, args["network"], outname)
+
+    return outname
+
 
 if __name__ == "__main__":
     # Process arguments
     args = parse_arguments()
+
+    from PCA import make_simple_inference, make_tuned_inference
+    from directivity import make_prediction_directivity
+    from resources import allocated_cpus, limit_threads
+    from resources import plan_layout, print_layout
+
+    # Cache accelerator may be removed to save disk space
+    from clusterlib.storage import sqlite3_dumps
+
     pprint(args)
     job_hash = make_hash(args)
 
-    name = args["network"]
+    # Share the allocated cores between processes and BLAS threads
+    layout = plan_layout(allocated_cpus(args.get("n_cpus")))
+    print_layout(layout)
 
-    # Loading data
-    print('Loading data...')
-    X = np.loadtxt(args["fluorescence"], delimiter=",")
-    X = np.asfortranarray(X, dtype=np.float32)
-    # pos = np.loadtxt(args["position"], delimiter=",")
+    if "chunk_size" in args:
+        # Out-of-core inference, the recording is never loaded as a whole
+        from outofcore import FrameReader, chunked_inference
+        from outofcore import chunked_directivity
+
+        transform = None
+        if args.get("killing") is not None:
+            transform = partial(kill_neurons, network=args["network"],
+                                killing=args["killing"])
+
+        print('Reading data by chunks of %s frames...' % args["chunk_size"])
+        reader = FrameReader(args["fluorescence"], transform=transform)
+
+        with limit_threads(layout["pca"]["n_threads"]):
+            y_pca = chunked_inference(reader, method=args["method"],
+                                      chunk_size=args["chunk_size"])
+
+        if args["directivity"]:
+            print('Using information about directivity...')
+            with limit_threads(layout["directivity"]["n_threads"]):
+                y_directivity = chunked_directivity(
+                    reader, chunk_size=args["chunk_size"],
+                    n_jobs=layout["directivity"]["n_jobs"])
 
-    # Should we remove some neurons?
-    if "killing" in args:
-        if args["network"] in ["normal-3",
-                               "normal-4"]:
-            X = kill(X, args["network"], args["killing"])
-        else:
-            raise ValueError("No killing specified for %s" % args["network"])
-
-    # Producing the prediction matrix
-    if args["method"] == 'tuned':
-        y_pca = make_tuned_inference(X)
     else:
-        y_pca = make_simple_inference(X)
+        # Loading data
+        print('Loading data...')
+        X = load_fluorescence(args["fluorescence"], args["network"],
+                              args.get("killing"))
+        # pos = np.loadtxt(args["position"], delimiter=",")
+
+        # Producing the prediction matrix
+        with limit_threads(layout["pca"]["n_threads"]):
+            if args["method"] == 'tuned':
+                y_pca = make_tuned_inference(X, tol=args.get("tol"))
+            else:
+                y_pca = make_simple_inference(X, tol=args.get("tol"))
+
+        if args["directivity"]:
+            print('Using information about directivity...')
+            with limit_threads(layout["directivity"]["n_threads"]):
+                y_directivity = make_prediction_directivity(
+                    X, n_jobs=layout["directivity"]["n_jobs"],
+                    sample_fraction=args.get("directivity_fraction"),
+                    sampling=args.get("directivity_sampling", "random"),
+                    random_state=0)
 
     if args["directivity"]:
-        print('Using information about directivity...')
-        y_directivity = make_prediction_directivity(X)
         # Perform stacking
-        score = 0.997 * y_pca + 0.003 * y_directivity
+        score = stack(y_pca, y_directivity)
     else:
         score = y_pca
 
     # Save data
     if "output_dir" in args:
-        if not os.path.exists(args["output_dir"]):
-            os.makedirs(args["output_dir"])
-
-        outname = os.path.join(args["output_dir"], "%s.csv" % job_hash)
-
-        # Generate the submission file ##
-        with open(outname, 'w') as fname:
-            fname.write("NET_neuronI_neuronJ,Strength\n")
-
-            for i, j in product(range(score.shape[0]), range(score.shape[1])):
-                line = "{0}_{1}_{2},{3}\n".format(name, i + 1, j + 1,
-                                                  score[i, j])
-                fname.write(line)
-
+        outname = save_prediction(score, args, job_hash)
         print("Infered connectivity score is saved at %s" % outname)
 
     # Indicate the job is finished
@@ -0,0 +1,308 @@
+# Authors: Aaron Qiu <zqiu@ulg.ac.be>,
+#          Antonio Sutera <a.sutera@ulg.ac.be>,
+#          Arnaud Joly <a.joly@ulg.ac.be>,
+#          Gilles Louppe <g.louppe@ulg.ac.be>,
+#          Vincent Francois <v.francois@ulg.ac.be>
+#
+# License: BSD 3 clause
+"""Out-of-core inference from recordings read by chunks of frames
+
+The recording is never loaded as a whole: it is read from disk by chunks of
+consecutive frames and only the sufficient statistics of each method are
+accumulated, i.e. the column sums and cross-products of the filtered
+signals for the partial correlation methods and the precedence counts for
+the directivity. The memory is O(n_nodes ** 2 + chunk_size * n_nodes)
+whatever the recording length.
+
+Filters are exact across chunk boundaries: enough overlapping frames are
+carried from one chunk to the next, and the frames which np.roll wraps
+around the recording are computed from its first and last frames. The
+tuned method reads the recording twice per filter, w_star needing the
+maximal activity of the whole recording. Results equal the in-memory ones
+up to round-off.
+"""
+from __future__ import division, print_function, absolute_import
+
+from collections import deque
+from itertools import islice
+
+import numpy as np
+
+from PCA import g, h, r, w, w_star, pca_precision
+from directivity import _hard_threshold, precedence_count
+from streaming import FILTERS
+from sweep import DEFAULT_GRID, METHOD_FILTERS
+from utils import scale
+
+MEMBER_WEIGHTS = DEFAULT_GRID["weights"][0]
+
+# Number of first and last frames kept by FrameReader
+N_BOUNDARY_FRAMES = 8
+
+
+class FrameReader(object):
+    """Read a fluorescence file by chunks of consecutive frames
+
+    Parameters
+    ----------
+    fname : string
+        Path to a fluorescence csv file or numpy .npy file. The .npy files
+        are memory mapped, csv files are read twice: once at construction to
+        count the frames and to keep the last ones.
+
+    transform : callable or None, optional (default=None)
+        Function applied to each chunk, e.g. to remove killed neurons.
+
+    """
+    def __init__(self, fname, transform=None):
+        self.fname = fname
+        self.transform = transform
+
+        if fname.endswith(".npy"):
+            self._data = np.load(fname, mmap_mode="r")
+            self.n_frames = self._data.shape[0]
+            self._tail = self._prepare(self._data[-N_BOUNDARY_FRAMES:])
+        else:
+            self._data = None
+            tail = deque(maxlen=N_BOUNDARY_FRAMES)
+            self.n_frames = 0
+            with open(fname) as fhandle:
+                for line in fhandle:
+                    if line.strip():
+                        tail.append(line)
+                        self.n_frames += 1
+            self._tail = self._prepare(np.loadtxt(list(tail), delimiter=",",
+                                                  ndmin=2))
+
+        self.n_nodes = self._tail.shape[1]
+        self._head = next(self.chunks(N_BOUNDARY_FRAMES))
+
+    def _prepare(self, X):
+        X = np.array(X, dtype=np.float32)
+        if self.transform is not None:
+            X = self.transform(X)
+        return X
+
+    def chunks(self, chunk_size):
+        """Iterate over the recording by chunks of chunk_size frames"""
+        if self._data is not None:
+            for start in range(0, self.n_frames, chunk_size):
+                yield self._prepare(self._data[start:start + chunk_size])
+            return
+
+        with open(self.fname) as fhandle:
+            lines = (line for line in fhandle if line.strip())
+            while True:
+                chunk = list(islice(lines, chunk_size))
+                if not chunk:
+                    break
+                yield self._prepare(np.loadtxt(chunk, delimiter=",",
+                                               ndmin=2))
+
+    def head(self, n_frames):
+        return self._head[:n_frames]
+
+    def tail(self, n_frames):
+        return self._tail[-n_frames:]
+
+
+def filtered_chunks(reader, LP, pipeline, chunk_size):
+    """Iterate over the filtered recording by chunks, in time order
+
+    Concatenating the chunks gives pipeline(g(f(X))) where f is the low-pass
+    filter LP of PCA.py and X the whole recording.
+
+    Parameters
+    ----------
+    reader : FrameReader
+        Recording to filter.
+
+    LP : string
+        Low-pass filter, one of "f1", "f2", "f3", "f4".
+
+    pipeline : callable
+        Frame-wise function applied after g, e.g. h.
+
+    chunk_size : integer
+        Number of frames read at once.
+
+    """
+    lp, lag, lead = FILTERS[LP]
+    n_context = lag + lead + 1
+    n_seam = n_context + 1
+    if reader.n_frames < 2 * n_seam:
+        raise ValueError("At least %s frames are needed, got %s"
+                         % (2 * n_seam, reader.n_frames))
+
+    # Row i of seam_rows is the difference between frames
+    # n_frames - n_seam + lag + i and the next one (modulo n_frames).
+    seam = np.vstack([reader.tail(n_seam), reader.head(n_seam)])
+    seam_rows = pipeline(g(lp(seam)[lag:len(seam) - lead]))
+    end = n_seam - lag - 1
+
+    # First rows, which wrap around the beginning of the recording
+    yield seam_rows[end + 1:end + 1 + lag]
+
+    context = np.zeros((0, reader.n_nodes), dtype=np.float32)
+    n_seen = 0
+    for chunk in reader.chunks(chunk_size):
+        window = np.vstack([context, chunk])
+        start = n_seen - len(context)
+        first = max(lag, n_seen - lead - 1) - start
+        if first < len(window) - lead - 1:
+            window_rows = window[first - lag:]
+            yield pipeline(g(lp(window_rows)[lag:len(window_rows) - lead]))
+
+        context = window[-n_context:]
+        n_seen += len(chunk)
+
+    # Last rows, which wrap around the end of the recording
+    yield seam_rows[end - lead:end]
+
+
+def _simple_pipeline(X):
+    return w(h(X))
+
+
+def _tuned_pipeline(X):
+    return r(h(X))
+
+
+def _last_row_sum(reader, LP, pipeline):
+    """Private function returning the activity of the last filtered frame,
+    which precedes the first one in w_star."""
+    _, lag, lead = FILTERS[LP]
+    n_seam = lag + lead + 2
+    seam = np.vstack([reader.tail(n_seam), reader.head(n_seam)])
+    seam_rows = pipeline(g(FILTERS[LP][0](seam)[lag:len(seam) - lead]))
+    return seam_rows[n_seam - lag - 2].sum()
+
+
+def _tuned_chunks(reader, LP, chunk_size):
+    """Private function iterating over the chunks of tuned_filter(X, LP)."""
+    # First pass: normalization of w_star
+    previous_sum = _last_row_sum(reader, LP, _tuned_pipeline)
+    normalization = -np.inf
+    for X_new in filtered_chunks(reader, LP, _tuned_pipeline, chunk_size):
+        if len(X_new) == 0:
+            continue
+        Sum_X_new = X_new.sum(axis=1)
+        Sum4 = Sum_X_new + 0.5 * np.r_[previous_sum, Sum_X_new[:-1]]
+        normalization = max(normalization, Sum4.max())
+        previous_sum = Sum_X_new[-1]
+
+    # Second pass: weighting
+    previous_sum = _last_row_sum(reader, LP, _tuned_pipeline)
+    for X_new in filtered_chunks(reader, LP, _tuned_pipeline, chunk_size):
+        if len(X_new) == 0:
+            continue
+        Sum_last = X_new[-1].sum()
+        yield w_star(X_new, normalization=normalization,
+                     previous_sum=previous_sum)
+        previous_sum = Sum_last
+
+
+def chunked_inference(reader, method="simple", chunk_size=10000):
+    """Out-of-core version of make_simple_inference and make_tuned_inference
+
+    Parameters
+    ----------
+    reader : FrameReader
+        Recording to process.
+
+    method : "simple" or "tuned", optional (default="simple")
+        Inference method.
+
+    chunk_size : integer, optional (default=10000)
+        Number of frames read at once.
+
+    Returns
+    -------
+    score : numpy array of shape (n_nodes, n_nodes)
+        Pairwise neuron connectivity score.
+
+    """
+    n_nodes = reader.n_nodes
+    weight = 0
+    y_pred_agg = np.zeros((n_nodes, n_nodes))
+
+    for LP in METHOD_FILTERS[method]:
+        print('Current: %s, chunks of %s frames' % (LP, chunk_size))
+        if method == "simple":
+            chunks = filtered_chunks(reader, LP, _simple_pipeline, chunk_size)
+        else:
+            chunks = _tuned_chunks(reader, LP, chunk_size)
+
+        n_rows = 0
+        sum_ = np.zeros(n_nodes)
+        cross = np.zeros((n_nodes, n_nodes))
+        for X_new in chunks:
+            n_rows += X_new.shape[0]
+            sum_ += X_new.sum(axis=0)
+            cross += np.dot(X_new.T, X_new)
+
+        covariance = (cross - np.outer(sum_, sum_) / n_rows) / (n_rows - 1)
+        y_pred_agg -= (MEMBER_WEIGHTS[LP] *
+                       pca_precision(covariance, int(0.8 * n_nodes)))
+        weight += MEMBER_WEIGHTS[LP]
+
+    return scale(y_pred_agg / weight, copy=False)
+
+
+def chunked_directivity(reader, threshold=0.12, chunk_size=10000, n_jobs=1):
+    """Out-of-core version of make_prediction_directivity
+
+    Parameters
+    ----------
+    reader : FrameReader
+        Recording to process.
+
+    threshold : float, optional (default=0.12)
+        Threshold value for hard thresholding filter.
+
+    chunk_size : integer, optional (default=10000)
+        Number of frames read at once.
+
+    n_jobs : integer, optional (default=1)
+        The number of jobs to count precedence events in parallel.
+
+    Returns
+    -------
+    score : numpy array of shape (n_nodes, n_nodes)
+        Pairwise neuron connectivity score.
+
+    """
+    n_frames = reader.n_frames
+    count = np.zeros((reader.n_nodes, reader.n_nodes))
+
+    # As in make_prediction_directivity, the first frames look back at the
+    # last ones through negative indexing.
+    context = reader.tail(3).astype(np.float64)
+    last_filtered = None
+    last_thresholded = None
+    n_seen = 0
+
+    for chunk in reader.chunks(chunk_size):
+        window = np.vstack([context, chunk.astype(np.float64)])
+        X_new = (window[3:] + 1 * window[2:-1] + 0.8 * window[1:-2] +
+                 0.4 * window[:-3])
+
+        # First and last frames are left to zero
+        frames = np.arange(n_seen, n_seen + len(chunk))
+        X_new[(frames == 0) | (frames == n_frames - 1)] = 0.
+
+        if last_filtered is not None:
+            X_new = np.vstack([last_filtered, X_new])
+        last_filtered = X_new[-1:]
+        X_new = _hard_threshold(np.diff(X_new, axis=0), threshold)
+
+        if last_thresholded is not None:
+            X_new = np.vstack([last_thresholded, X_new])
+        if len(X_new) > 1:
+            count += precedence_count(X_new, n_jobs=n_jobs)
+        last_thresholded = X_new[-1:]
+
+        context = window[-3:]
+        n_seen += len(chunk)
+
+    return scale(count - np.transpose(count), copy=False)
@@ -0,0 +1,167 @@
+# Authors: Aaron Qiu <zqiu@ulg.ac.be>,
+#          Antonio Sutera <a.sutera@ulg.ac.be>,
+#          Arnaud Joly <a.joly@ulg.ac.be>,
+#          Gilles Louppe <g.louppe@ulg.ac.be>,
+#          Vincent Francois <v.francois@ulg.ac.be>
+#
+# License: BSD 3 clause
+"""Sharing the allocated cores between processes and BLAS threads
+
+Jobs packed on a shared node must not use more cores than the scheduler
+gave them. The PCA stage relies on multithreaded BLAS/LAPACK in a single
+process, while the directivity stage uses worker processes doing
+elementwise numpy operations. Each stage thus gets all the allocated cores,
+either as BLAS threads or as processes, but never both.
+
+BLAS reads the thread environment variables when numpy is imported. Once
+numpy is imported, BLAS threads are only limited with threadpoolctl, if it
+is installed, otherwise the limit only applies to child processes and a
+warning is raised. The launcher thus sets those variables in the job
+command itself.
+"""
+from __future__ import division, print_function, absolute_import
+
+import os
+import re
+import sys
+import warnings
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+
+try:
+    from importlib.util import find_spec
+except ImportError:  # Python 2
+    from pkgutil import find_loader as find_spec
+
+THREAD_VARIABLES = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                    "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS",
+                    "NUMEXPR_NUM_THREADS"]
+
+
+def _scheduler_cpus():
+    """Private function returning the number of cores allocated by a
+    scheduler, or None if not run through a known scheduler."""
+    if "SLURM_CPUS_PER_TASK" in os.environ:
+        return int(os.environ["SLURM_CPUS_PER_TASK"])
+
+    if "SLURM_JOB_CPUS_PER_NODE" in os.environ:
+        # Formatted as "4" or "4(x2),2"
+        match = re.match(r"\d+", os.environ["SLURM_JOB_CPUS_PER_NODE"])
+        if match:
+            return int(match.group())
+
+    for variable in ["NSLOTS", "PBS_NUM_PPN"]:
+        if variable in os.environ:
+            return int(os.environ[variable])
+
+    return None
+
+
+def allocated_cpus(n_cpus=None):
+    """Number of cores this process may use
+
+    Parameters
+    ----------
+    n_cpus : integer or None, optional (default=None)
+        Explicit number of cores. If None, it is read from the scheduler
+        environment (SLURM, SGE, PBS), then from the CPU affinity of the
+        process, then it is the number of cores of the node.
+
+    Returns
+    -------
+    n_cpus : integer
+        Number of allocated cores.
+
+    """
+    if n_cpus is None:
+        n_cpus = _scheduler_cpus()
+
+    if n_cpus is None:
+        try:
+            n_cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            n_cpus = cpu_count()
+
+    return max(1, n_cpus)
+
+
+def plan_layout(n_cpus):
+    """Split n_cpus between processes and BLAS threads for each stage
+
+    Returns a dict mapping stage names to dict with the number of
+    processes (n_jobs) and of BLAS threads per process (n_threads).
+    """
+    return {"pca": {"n_jobs": 1, "n_threads": n_cpus},
+            "directivity": {"n_jobs": n_cpus, "n_threads": 1}}
+
+
+def thread_environment(n_threads):
+    """Thread environment variables limiting BLAS/OpenMP to n_threads"""
+    return dict((variable, str(n_threads)) for variable in THREAD_VARIABLES)
+
+
+_HAS_THREADPOOLCTL = None
+
+
+def _has_threadpoolctl():
+    """Private function checking once whether threadpoolctl is installed."""
+    global _HAS_THREADPOOLCTL
+
+    if _HAS_THREADPOOLCTL is None:
+        _HAS_THREADPOOLCTL = find_spec("threadpoolctl") is not None
+
+    return _HAS_THREADPOOLCTL
+
+
+def can_limit_threads(n_threads):
+    """Whether the BLAS threads of this process can be limited to n_threads
+
+    This is the case if numpy is not imported yet, if the thread
+    environment variables were already set to n_threads at startup, or if
+    threadpoolctl is installed.
+    """
+    if "numpy" not in sys.modules:
+        return True
+
+    if all(os.environ.get(variable) == value
+           for variable, value in thread_environment(n_threads).items()):
+        return True
+
+    return _has_threadpoolctl()
+
+
+def print_layout(layout):
+    for stage in sorted(layout):
+        n_threads = layout[stage]["n_threads"]
+        print("Layout %s: %s processes x %s BLAS threads%s"
+              % (stage, layout[stage]["n_jobs"], n_threads,
+                 "" if can_limit_threads(n_threads) else
+                 " (not applied in this process, threadpoolctl is missing)"))
+
+
+@contextmanager
+def limit_threads(n_threads):
+    """Limit the BLAS/OpenMP threads of this process and of its children"""
+    if not can_limit_threads(n_threads):
+        warnings.warn("BLAS threads of this process can not be limited to %s "
+                      "without threadpoolctl, only its child processes are."
+                      % n_threads)
+
+    old_environ = dict((variable, os.environ.get(variable))
+                       for variable in THREAD_VARIABLES)
+    os.environ.update(thread_environment(n_threads))
+
+    try:
+        if _has_threadpoolctl():
+            from threadpoolctl import threadpool_limits
+            with threadpool_limits(limits=n_threads):
+                yield
+        else:
+            yield
+
+    finally:
+        for variable, value in old_environ.items():
+            if value is None:
+                del os.environ[variable]
+            else:
+                os.environ[variable] = value
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+
+# Authors: Aaron Qiu <zqiu@ulg.ac.be>,
+#          Antonio Sutera <a.sutera@ulg.ac.be>,
+#          Arnaud Joly <a.joly@ulg.ac.be>,
+#          Gilles Louppe <g.louppe@ulg.ac.be>,
+#          Vincent Francois <v.francois@ulg.ac.be>
+#
+# License: BSD 3 clause
+"""Long-lived localhost HTTP service exposing main.py
+
+Loaded recordings and intermediate scores are kept in memory, so that
+related queries (another method, directivity on/off, another killing level)
+do not reload nor recompute anything already known.
+
+Start the service with
+
+    python server.py --port 8000 --cache_size 4000
+
+and query it with the arguments of main.py, for instance
+
+    curl "localhost:8000/predict?fluorescence=...&network=normal-1&method=simple&directivity=1&output_dir=..."
+
+If output_dir is given, the submission file (or the top_k file) is written
+as with main.py and a json summary is returned. Otherwise, the score matrix is returned in the
+numpy .npy format. The cache content is listed at /cache.
+"""
+from __future__ import division, print_function, absolute_import
+
+import argparse
+import io
+import json
+from collections import OrderedDict
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from urllib.parse import urlparse, parse_qsl
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from urlparse import urlparse, parse_qsl
+
+import numpy as np
+
+from main import get_sqlite3_path
+from main import kill_neurons
+from main import load_fluorescence
+from main import make_hash
+from main import parse_arguments
+from main import save_prediction
+from main import stack
+
+
+class LRUCache(object):
+    """Least recently used cache of numpy arrays under a memory budget
+
+    Parameters
+    ----------
+    max_bytes : integer
+        Memory budget in bytes. Arrays larger than the budget are not cached.
+
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.n_hits = 0
+        self.n_misses = 0
+        self._data = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, compute):
+        """Return the cached value of key, calling compute() on a miss"""
+        if key in self._data:
+            self.n_hits += 1
+            value = self._data.pop(key)
+            self._data[key] = value
+            return value
+
+        self.n_misses += 1
+        value = compute()
+        if value.nbytes <= self.max_bytes:
+            self._data[key] = value
+            self.n_bytes += value.nbytes
+            while self.n_bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.n_bytes -= evicted.nbytes
+
+        return value
+
+    def summary(self):
+        return {"n_bytes": self.n_bytes,
+                "max_bytes": self.max_bytes,
+                "n_hits": self.n_hits,
+                "n_misses": self.n_misses,
+                "keys": [list(key) for key in self._data]}
+
+
+class ConnectivityService(object):
+    """In-process version of main.py with cached recordings and scores"""
+    def __init__(self, cache):
+        self.cache = cache
+
+    def load(self, fluorescence, network, killing=None):
+        X = self.cache.get(("fluorescence", fluorescence),
+                           lambda: load_fluorescence(fluorescence, network))
+        if killing is None:
+            return X
+
+        return self.cache.get(("fluorescence", fluorescence, killing),
+                              lambda: kill_neurons(X, network, killing))
+
+    def predict(self, args):
+        from PCA import make_simple_inference, make_tuned_inference
+        from directivity import make_prediction_directivity
+
+        key = (args["fluorescence"], args["network"], args.get("killing"))
+        X = self.load(*key)
+
+        if args["method"] == 'tuned':
+            inference = make_tuned_inference
+        else:
+            inference = make_simple_inference
+        tol = args.get("tol")
+        y_pca = self.cache.get(("pca", args["method"], tol) + key,
+                               lambda: inference(X, tol=tol))
+
+        if not args["directivity"]:
+            return y_pca
+
+        fraction = args.get("directivity_fraction")
+        sampling = args.get("directivity_sampling", "random")
+        y_directivity = self.cache.get(
+            ("directivity", fraction, sampling) + key,
+            lambda: make_prediction_directivity(X, sample_fraction=fraction,
+                                                sampling=sampling,
+                                                random_state=0))
+        return stack(y_pca, y_directivity)
+
+    def handle(self, args):
+        """Process the arguments of main.py as main.py would"""
+        job_hash = make_hash(args)
+        score = self.predict(args)
+
+        if "output_dir" not in args:
+            return job_hash, score
+
+        # Cache accelerator may be removed to save disk space
+        from clusterlib.storage import sqlite3_dumps
+
+        outname = save_prediction(score, args, job_hash)
+        sqlite3_dumps({job_hash: "JOB DONE"}, get_sqlite3_path())
+
+        return job_hash, outname
+
+
+def make_handler(service):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _send(self, code, body, content_type="application/json"):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_json(self, code, content):
+            self._send(code, json.dumps(content).encode("utf-8"))
+
+        def do_GET(self):
+            url = urlparse(self.path)
+
+            if url.path == "/cache":
+                self._send_json(200, service.cache.summary())
+                return
+
+            if url.path != "/predict":
+                self._send_json(404, {"error": "Unknown path %s" % url.path})
+                return
+
+            cmd_parameters = []
+            for key, value in parse_qsl(url.query):
+                cmd_parameters.extend(["--%s" % key, value])
+
+            try:
+                args = parse_arguments(cmd_parameters)
+            except SystemExit:
+                self._send_json(400, {"error": "Invalid arguments %s"
+                                               % url.query})
+                return
+
+            try:
+                job_hash, result = service.handle(args)
+            except (IOError, ValueError) as error:
+                self._send_json(400, {"error": str(error)})
+                return
+
+            if isinstance(result, np.ndarray):
+                buf = io.BytesIO()
+                np.save(buf, result)
+                self._send(200, buf.getvalue(), "application/octet-stream")
+            else:
+                self._send_json(200, {"job_hash": job_hash,
+                                      "output": result})
+
+    return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default="localhost")
+    parser.add_argument('-p', '--port', type=int, default=8000)
+    parser.add_argument('-c', '--cache_size', type=int, default=4000,
+                        help='Memory budget of the cache in MB')
+    args = vars(parser.parse_args())
+
+    service = ConnectivityService(LRUCache(args["cache_size"] * 2 ** 20))
+    httpd = HTTPServer((args["host"], args["port"]), make_handler(service))
+    print("Serving on %s:%s" % (args["host"], args["port"]))
+    httpd.serve_forever()
@@ -0,0 +1,89 @@
+# Authors: Aaron Qiu <zqiu@ulg.ac.be>,
+#          Antonio Sutera <a.sutera@ulg.ac.be>,
+#          Arnaud Joly <a.joly@ulg.ac.be>,
+#          Gilles Louppe <g.louppe@ulg.ac.be>,
+#          Vincent Francois <v.francois@ulg.ac.be>
+#
+# License: BSD 3 clause
+"""Spectral analysis of the ground truth networks"""
+from __future__ import division, print_function, absolute_import
+
+import os
+
+from scipy.linalg import svdvals
+
+from utils import load_network
+
+CACHE_DIR = os.path.join(os.environ["HOME"],
+                         "scikit_learn_data/connectomics/cache_dir")
+
+
+def spectra(graph):
+    """Normalised singular values and PCA explained variance ratio
+
+    Both spectra are obtained from singular values only, of graph and of
+    graph with centred columns, without computing any singular vector. The
+    explained variance ratio is the one of PCA(whiten=True).fit(graph).
+
+    Parameters
+    ----------
+    graph : numpy array of shape (n_nodes, n_nodes)
+        Adjacency matrix.
+
+    Returns
+    -------
+    singular_values : numpy array of shape (n_nodes, )
+        Singular values of graph divided by their sum, in decreasing order.
+
+    explained_variance_ratio : numpy array of shape (n_nodes, )
+        Explained variance ratio of the principal components of graph, in
+        decreasing order.
+
+    """
+    singular_values = svdvals(graph)
+    singular_values /= singular_values.sum()
+
+    explained_variance = svdvals(graph - graph.mean(axis=0)) ** 2
+    explained_variance_ratio = explained_variance / explained_variance.sum()
+
+    return singular_values, explained_variance_ratio
+
+
+def _network_spectra(fname, mtime, n_nodes):
+    """Private function computing the spectra of a network file.
+
+    The modification time is only there to invalidate the cache.
+    """
+    return spectra(load_network(fname, n_nodes=n_nodes))
+
+
+def compute_all_spectra(fnames, n_nodes=1000, n_jobs=-1, cachedir=CACHE_DIR):
+    """Spectra of several network files computed in parallel
+
+    Parameters
+    ----------
+    fnames : list of string
+        Paths to the network_*.txt files.
+
+    n_nodes : integer, optional (default=1000)
+        Number of neurons of the networks.
+
+    n_jobs : integer, optional (default=-1)
+        The number of processes used to compute the spectra.
+        If -1, then the number of jobs is set to the number of cores.
+
+    cachedir : string or None, optional (default=CACHE_DIR)
+        Directory where the spectra are cached. If None, no caching.
+
+    Returns
+    -------
+    all_spectra : list of tuple
+        The output of spectra for each network file.
+
+    """
+    from sklearn.externals.joblib import Memory, Parallel, delayed
+
+    network_spectra = Memory(cachedir, verbose=0).cache(_network_spectra)
+    return Parallel(n_jobs=n_jobs)(
+        delayed(network_spectra)(fname, os.path.getmtime(fname), n_nodes)
+        for fname in fnames)
@@ -0,0 +1,175 @@
+# Authors: Aaron Qiu <zqiu@ulg.ac.be>,
+#          Antonio Sutera <a.sutera@ulg.ac.be>,
+#          Arnaud Joly <a.joly@ulg.ac.be>,
+#          Gilles Louppe <g.louppe@ulg.ac.be>,
+#          Vincent Francois <v.francois@ulg.ac.be>
+#
+# License: BSD 3 clause
+"""Online connectivity inference from incrementally arriving frames
+
+Only the simplified method can be streamed exactly: its filters and its
+weighting function w are local in time, while w_star of the tuned method
+normalises each frame by the maximum activity over the whole recording.
+
+The ensemble of make_simple_inference reduces to one member per low-pass
+filter, since all its thresholds end up with the default hard threshold of
+h. The streaming estimator thus keeps one set of running statistics per
+filter.
+"""
+from __future__ import division, print_function, absolute_import
+
+import numpy as np
+
+from PCA import f1, f2, f3, f4, g, h, w, pca_precision
+from utils import scale
+
+# Low-pass filters and their support as (number of past frames, number of
+# future frames) used to compute one filtered frame.
+FILTERS = {"f1": (f1, 1, 1),
+           "f2": (f2, 3, 0),
+           "f3": (f3, 1, 2),
+           "f4": (f4, 0, 3)}
+
+
+def _filter_rows(X, LP):
+    """Private function applying the simplified pipeline to a window of
+    consecutive frames.
+
+    Only the rows which do not depend on the circular boundary of np.roll
+    are returned, they correspond to rows lag to len(X) - lead - 2 of the
+    batch pipeline applied to X.
+    """
+    lp, lag, lead = FILTERS[LP]
+    X = g(lp(X)[lag:len(X) - lead])
+    return w(h(X))
+
+
+class StreamingInference(object):
+    """Online version of the simplified inference method
+
+    Blocks of frames are fed with partial_fit. Each block is filtered with
+    the filters of PCA.py, keeping enough past frames across block
+    boundaries, and only the running sums and cross-products of the
+    filtered signals are stored. The memory is thus independent of the
+    recording length and the cost of a block is proportional to its size.
+
+    predict gives, on demand, the connectivity score that
+    make_simple_inference would produce on all frames seen so far, up to
+    numerical precision.
+
+    Parameters
+    ----------
+    filters : dict, optional (default={"f1": 1., "f2": 0.9})
+        Low-pass filters of the ensemble and their weights.
+
+    """
+    def __init__(self, filters=None):
+        if filters is None:
+            filters = {"f1": 1., "f2": 0.9}
+        for LP in filters:
+            if LP not in FILTERS:
+                raise ValueError("Unknown filter, got %s." % LP)
+        self.filters = filters
+
+        # Number of context frames needed around a filtered frame
+        self.n_context = max(lag + lead + 1
+                             for _, lag, lead in FILTERS.values())
+
+    def _reset(self, n_nodes):
+        self.n_nodes_ = n_nodes
+        self.n_frames_ = 0
+        self.head_ = np.zeros((0, n_nodes))
+        self.tail_ = np.zeros((0, n_nodes))
+        self.n_rows_ = dict((LP, 0) for LP in self.filters)
+        self.sum_ = dict((LP, np.zeros(n_nodes)) for LP in self.filters)
+        self.cross_ = dict((LP, np.zeros((n_nodes, n_nodes)))
+                           for LP in self.filters)
+
+    def _accumulate(self, LP, X_new):
+        self.n_rows_[LP] += X_new.shape[0]
+        self.sum_[LP] += X_new.sum(axis=0)
+        self.cross_[LP] += np.dot(X_new.T, X_new)
+
+    def partial_fit(self, X):
+        """Update the running statistics with a block of frames
+
+        Parameters
+        ----------
+        X : numpy array of shape (n_frames, n_nodes)
+            Consecutive fluorescence frames following the ones already seen.
+
+        Returns
+        -------
+        self : object
+            Returns self.
+
+        """
+        if not hasattr(self, "n_frames_"):
+            self._reset(X.shape[1])
+        elif X.shape[1] != self.n_nodes_:
+            raise ValueError("Number of nodes should be %s, got %s"
+                             % (self.n_nodes_, X.shape[1]))
+
+        window = np.vstack([self.tail_, X]).astype(X.dtype)
+        start = self.n_frames_ - len(self.tail_)
+
+        for LP in self.filters:
+            _, lag, lead = FILTERS[LP]
+            # Rows lag, lag + 1, ... of the batch pipeline never wrap around
+            # the beginning of the recording, the others are left to predict.
+            first = max(lag, self.n_frames_ - lead - 1) - start
+            if first < len(window) - lead - 1:
+                self._accumulate(LP, _filter_rows(window[first - lag:], LP))
+
+        if len(self.head_) < self.n_context:
+            self.head_ = np.vstack([self.head_,
+                                    X[:self.n_context - len(self.head_)]])
+        self.tail_ = window[-self.n_context:]
+        self.n_frames_ += X.shape[0]
+
+        return self
+
+    def _boundary_rows(self, LP):
+        """Private function computing the filtered rows which, as np.roll,
+        wrap around the beginning and the end of the recording."""
+        _, lag, lead = FILTERS[LP]
+        n_context = len(self.head_)
+        seam = np.vstack([self.tail_, self.head_]).astype(self.tail_.dtype)
+        X_new = _filter_rows(seam, LP)
+
+        # Row i of X_new is the difference between frames
+        # n_frames - n_context + lag + i and the next one (modulo n_frames).
+        # Keep the last lead rows of the recording and its first lag rows.
+        end = n_context - lag - 1
+        return np.vstack([X_new[end - lead:end], X_new[end + 1:end + 1 + lag]])
+
+    def predict(self):
+        """Connectivity score of all frames seen so far
+
+        Returns
+        -------
+        score : numpy array of shape (n_nodes, n_nodes)
+            Pairwise neuron connectivity score.
+
+        """
+        if not hasattr(self, "n_frames_"):
+            raise ValueError("partial_fit should be called before predict.")
+        if self.n_frames_ < 2 * self.n_context:
+            raise ValueError("At least %s frames are needed, got %s"
+                             % (2 * self.n_context, self.n_frames_))
+
+        n_components = int(0.8 * self.n_nodes_)
+        weight = 0
+        y_pred_agg = np.zeros((self.n_nodes_, self.n_nodes_))
+
+        for LP, weight_LP in self.filters.items():
+            X_new = self._boundary_rows(LP)
+            n_rows = self.n_rows_[LP] + X_new.shape[0]
+            sum_ = self.sum_[LP] + X_new.sum(axis=0)
+            cross = self.cross_[LP] + np.dot(X_new.T, X_new)
+
+            covariance = (cross - np.outer(sum_, sum_) / n_rows) / (n_rows - 1)
+            y_pred_agg += - pca_precision(covariance, n_components) * weight_LP
+            weight += weight_LP
+
+        return scale(y_pred_agg / weight, copy=False)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+# Authors: Aaron Qiu <zqiu@ulg.ac.be>,
+#          Antonio Sutera <a.sutera@ulg.ac.be>,
+#          Arnaud Joly <a.joly@ulg.ac.be>,
+#          Gilles Louppe <g.louppe@ulg.ac.be>,
+#          Vincent Francois <v.francois@ulg.ac.be>
+#
+# License: BSD 3 clause
+"""Hyper-parameter sweep of the inference methods on one network
+
+All candidates of a grid over the thresholds, the member weights, the
+w_star bands and the stacking ratio are scored against the ground truth in
+a single process. Each member precision is fitted once: the filtered
+signals are shared between thresholds, the member precisions are summed
+per threshold set and candidates only recombine those sums with their
+weights. The directivity score is computed once.
+
+    python sweep.py -f fluorescence_normal-1.txt -g network_normal-1.txt \
+        -G grid.json -o sweep_normal-1.csv
+
+The grid file is a json dict with the keys of DEFAULT_GRID, or a list of
+such dicts. Bands are given as [[[r_min, r_max, exponent], ...], exponent]
+(see PCA.W_STAR_BANDS) or null for the default bands of the tuned method.
+
+Note that make_simple_inference and make_tuned_inference apply the default
+hard threshold of h for every element of t, so their ensembles correspond
+to the threshold set (0.11, ) here.
+"""
+from __future__ import division, print_function, absolute_import
+
+import argparse
+import json
+from collections import defaultdict
+
+from PCA import f1, f2, f3, f4, g, h, r, w, w_star
+from analyse import METRICS
+from main import load_fluorescence
+from utils import expand_grid
+from utils import load_network
+from utils import scale
+
+LOW_PASS = {"f1": f1, "f2": f2, "f3": f3, "f4": f4}
+
+METHOD_FILTERS = {"simple": ["f1", "f2"],
+                  "tuned": ["f1", "f2", "f3", "f4"]}
+
+DEFAULT_GRID = {"method": ["simple", "tuned"],
+                "thresholds": [[0.11]],
+                "weights": [{"f1": 1., "f2": 0.9, "f3": 0.01, "f4": 0.7}],
+                "bands": [None],
+                "stacking": [1., 0.997]}
+
+
+def _freeze(value):
+    """Private function turning nested lists into hashable tuples."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(x) for x in value)
+    return value
+
+
+def _candidates(grids):
+    """Private function enumerating unique and hashable candidates."""
+    seen = set()
+    for candidate in expand_grid(grids):
+        candidate["thresholds"] = _freeze(candidate["thresholds"])
+        if candidate["method"] == "simple":
+            # Bands are only used by the tuned method
+            candidate["bands"] = None
+        candidate["bands"] = _freeze(candidate["bands"])
+
+        key = (candidate["method"], candidate["thresholds"],
+               candidate["bands"], candidate["stacking"],
+               tuple(sorted(candidate["weights"].items())))
+        if key not in seen:
+            seen.add(key)
+            yield candidate
+
+
+def member_precisions(X, candidates):
+    """Sum of the member precisions needed by the candidates
+
+    Parameters
+    ----------
+    X : numpy array of shape (n_samples, n_nodes)
+        Fluorescence signals.
+
+    candidates : list of dict
+        Candidates with keys method, thresholds and bands.
+
+    Returns
+    -------
+    precisions : dict
+        Map (method, thresholds, bands, LP) to the sum over thresholds of
+        the negated precisions of the members with low-pass filter LP. A
+        threshold repeated in thresholds is counted as many times.
+
+    """
+    from sklearn.decomposition import PCA
+
+    n_components = int(0.8 * X.shape[1])
+
+    # Map each member to the threshold sets it belongs to, with the number
+    # of times its threshold is repeated in the set
+    members = defaultdict(dict)
+    for candidate in candidates:
+        thresholds = candidate["thresholds"]
+        for LP in METHOD_FILTERS[candidate["method"]]:
+            for threshold in thresholds:
+                members[LP, threshold, candidate["method"],
+                        candidate["bands"]][thresholds] = \
+                    thresholds.count(threshold)
+
+    precisions = dict()
+    for LP in set(member[0] for member in members):
+        # Shared between all thresholds of the filter
+        X_diff = g(LOW_PASS[LP](X))
+
+        for member in [key for key in members if key[0] == LP]:
+            _, threshold, method, bands = member
+            print('Current: %0.3f, %s, %s' % (threshold, LP, method))
+
+            if method == "simple":
+                X_new = w(h(X_diff, threshold))
+            else:
+                X_new = w_star(r(h(X_diff, threshold)), bands=bands)
+
+            pca = PCA(whiten=True, n_components=n_components).fit(X_new)
+            y_pred = - pca.get_precision()
+
+            for thresholds, count in members[member].items():
+                key = (method, thresholds, bands, LP)
+                if key in precisions:
+                    precisions[key] += count * y_pred
+                else:
+                    precisions[key] = count * y_pred
+
+    return precisions
+
+
+def sweep(X, y_true, grid=DEFAULT_GRID, y_directivity=None):
+    """Score every candidate of a grid against the ground truth
+
+    Parameters
+    ----------
+    X : numpy array of shape (n_samples, n_nodes)
+        Fluorescence signals.
+
+    y_true : numpy array of shape (n_nodes, n_nodes)
+        Ground truth adjacency matrix.
+
+    grid : dict or list of dict, optional (default=DEFAULT_GRID)
+        Candidate values of method, thresholds, weights, bands and
+        stacking.
+
+    y_directivity : numpy array of shape (n_nodes, n_nodes) or None
+        Directivity score. If None, it is computed when a candidate has
+        a stacking ratio lower than 1.
+
+    Returns
+    -------
+    results : list of dict
+        The candidates with their scores for each metric of analyse.py,
+        sorted by decreasing roc_auc_score.
+
+    """
+    if isinstance(grid, dict):
+        grid = [grid]
+    candidates = list(_candidates(grid))
+
+    precisions = member_precisions(X, candidates)
+
+    if y_directivity is None and any(c["stacking"] < 1 for c in candidates):
+        from directivity import make_prediction_directivity
+        y_directivity = make_prediction_directivity(X)
+
+    results = []
+    for candidate in candidates:
+        y_pred_agg = 0
+        weight = 0
+        for LP in METHOD_FILTERS[candidate["method"]]:
+            key = (candidate["method"], candidate["thresholds"],
+                   candidate["bands"], LP)
+            weight_LP = candidate["weights"][LP]
+            y_pred_agg = y_pred_agg + weight_LP * precisions[key]
+            weight += weight_LP * len(candidate["thresholds"])
+
+        score = scale(y_pred_agg / weight, copy=False)
+        if candidate["stacking"] < 1:
+            score = (candidate["stacking"] * score +
+                     (1 - candidate["stacking"]) * y_directivity)
+
+        row = dict(candidate)
+        row.update((name, metric(y_true.ravel(), score.ravel()))
+                   for name, metric in METRICS.items())
+        results.append(row)
+
+    results.sort(key=lambda row: row["roc_auc_score"], reverse=True)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--fluorescence', type=str, required=True,
+                        help='Path to the fluorescence file')
+    parser.add_argument('-g', '--ground_truth', type=str, required=True,
+                        help='Path to the network file')
+    parser.add_argument('-G', '--grid', type=str, default=None,
+                        help='Path to a json grid of candidates')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='Path of the csv result table if wanted')
+    args = vars(parser.parse_args())
+
+    import pandas as pd
+
+    grid = DEFAULT_GRID
+    if args["grid"] is not None:
+        with open(args["grid"]) as fhandle:
+            grid = json.load(fhandle)
+
+    X = load_fluorescence(args["fluorescence"], network=None)
+    y_true = load_network(args["ground_truth"], n_nodes=X.shape[1])
+
+    results = pd.DataFrame(sweep(X, y_true, grid))
+    results["weights"] = results["weights"].apply(
+        lambda weights: json.dumps(weights, sort_keys=True))
+
+    print(results.to_string())
+    if args["output"] is not None:
+        results.to_csv(args["output"], index=False)
@@ -7,7 +7,11 @@
 # License: BSD 3 clause
 from __future__ import division, print_function, absolute_import
 
+import os
+from itertools import product
+
 import numpy as np
+from scipy.sparse import coo_matrix
 
 
 def min_diagonal(X):
@@ -15,11 +19,157 @@ def min_diagonal(X):
     return X
 
 
-def min_max(X):
+def min_max(X, copy=True):
+    if not copy:
+        X -= X.min()
+        X /= X.max()
+        return X
+
     X_scale = X.ravel() - X.min()
     X_scale /= X_scale.max()
     return X_scale.reshape(X.shape)
 
 
-def scale(X):
-    return min_max(min_diagonal(X))
+def scale(X, copy=True):
+    """Min-max scaling of a score matrix with its diagonal set to the minimum
+
+    The diagonal of X is always modified in place. If copy is False, the
+    scaling is also done in place.
+    """
+    return min_max(min_diagonal(X), copy=copy)
+
+
+def top_k_edges(score, k, per_node=False):
+    """Select the k strongest off-diagonal edges of a score matrix
+
+    Parameters
+    ----------
+    score : numpy array of shape (n_nodes, n_nodes)
+        Pairwise neuron connectivity score.
+
+    k : integer
+        Number of selected edges, overall or per neuron.
+
+    per_node : boolean, optional (default=False)
+        If True, select the k strongest outgoing edges of each neuron.
+
+    Returns
+    -------
+    row, col : numpy arrays of shape (n_edges, )
+        Selected edges, sorted by decreasing score.
+
+    value : numpy array of shape (n_edges, )
+        Score of the selected edges.
+
+    """
+    n_nodes = score.shape[0]
+
+    if per_node:
+        k = min(k, n_nodes - 1)
+        # The k + 1 strongest scores of a row contain its k strongest
+        # off-diagonal ones
+        col = np.argpartition(score, n_nodes - k - 1, axis=1)[:, -k - 1:]
+        row = np.repeat(np.arange(n_nodes), k + 1).reshape(n_nodes, k + 1)
+        value = score[row, col]
+        value[row == col] = -np.inf
+        keep = np.argsort(-value, axis=1)[:, :k]
+        col = col[row[:, :k], keep].ravel()
+        row = row[:, :k].ravel()
+
+    else:
+        k = min(k, n_nodes * (n_nodes - 1))
+        # Same with the k + n_nodes strongest scores and the diagonal
+        n_candidates = min(k + n_nodes, n_nodes * n_nodes)
+        flat = score.ravel()
+        if n_candidates < flat.size:
+            index = np.argpartition(flat, flat.size - n_candidates)
+            index = index[-n_candidates:]
+        else:
+            index = np.arange(flat.size)
+        row, col = np.unravel_index(index, score.shape)
+        off_diagonal = row != col
+        row, col = row[off_diagonal], col[off_diagonal]
+
+    order = np.argsort(-score[row, col], kind="mergesort")
+    if not per_node:
+        order = order[:k]
+    row, col = row[order], col[order]
+
+    return row, col, score[row, col]
+
+
+def save_top_k(fname, score, k, per_node=False):
+    """Save the k strongest edges of score with their rank (1 = strongest)"""
+    row, col, value = top_k_edges(score, k, per_node=per_node)
+    np.savez(fname, row=row, col=col, score=value,
+             rank=np.arange(1, len(value) + 1), shape=score.shape)
+
+
+def load_top_k(fname):
+    """Load the edges saved by save_top_k as a dict of arrays"""
+    with np.load(fname) as data:
+        return dict((key, data[key]) for key in data.files)
+
+
+def expand_grid(grids):
+    """Enumerate the parameters of a list of grids
+
+    Same enumeration as sklearn's ParameterGrid, without importing
+    scikit-learn.
+    """
+    for grid in grids:
+        keys = sorted(grid)
+        for values in product(*[grid[key] for key in keys]):
+            yield dict(zip(keys, values))
+
+
+def network_from_edges(raw_graph, n_nodes):
+    """Dense adjacency matrix from the rows "i,j,weight" of a network file"""
+    row = raw_graph[:, 0] - 1
+    col = raw_graph[:, 1] - 1
+    data = raw_graph[:, 2]
+    valid_index = data > 0
+    return coo_matrix((data[valid_index],
+                       (row[valid_index], col[valid_index])),
+                      shape=(n_nodes, n_nodes)).toarray()
+
+
+def load_network(fname, n_nodes=1000):
+    """Load a ground truth network as a dense adjacency matrix
+
+    The adjacency matrix is cached in the numpy format next to fname, so
+    that the text file is parsed only once.
+
+    Parameters
+    ----------
+    fname : string
+        Path to a network_*.txt file with lines "i,j,weight" (1-based), or
+        to an adjacency matrix in the numpy format.
+
+    n_nodes : integer, optional (default=1000)
+        Number of neurons of the network.
+
+    Returns
+    -------
+    graph : numpy array of shape (n_nodes, n_nodes)
+        Adjacency matrix with graph[i, j] > 0 iff i is connected to j.
+
+    """
+    if fname.endswith(".npy"):
+        return np.load(fname)
+
+    cache = os.path.splitext(fname)[0] + ".npy"
+    if (os.path.exists(cache) and
+            os.path.getmtime(cache) >= os.path.getmtime(fname)):
+        graph = np.load(cache)
+        if graph.shape == (n_nodes, n_nodes):
+            return graph
+
+    graph = network_from_edges(np.loadtxt(fname, delimiter=","), n_nodes)
+
+    try:
+        np.save(cache, graph)
+    except (IOError, OSError):
+        pass  # Read-only dataset directory
+
+    return graph